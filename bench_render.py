@@ -0,0 +1,98 @@
+import time
+from openpyxl import Workbook
+from openpyxl.cell import MergedCell
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from invoice_money import compute_totals
+from invoice_renderer import FIRST_PRODUCT_ROW, PRODUCT_ROW_MERGES, PRODUCT_ROW_STYLES, write_products
+from invoice_styles import StylePalette, apply_style
+
+# Micro-benchmarks of the invoice renderer: python bench_render.py
+
+
+def make_products(count):
+    return [
+        {"Nom du produit": f"PRODUIT {i}", "Quantité": i % 20 + 1, "Prix unitaire": 9.99}
+        for i in range(count)
+    ]
+
+
+def new_sheet():
+    ws = Workbook().active
+    styles = StylePalette(ws)
+    return ws, [styles.style_array(name) for name in PRODUCT_ROW_STYLES]
+
+
+def time_per_row(write_rows, count, repeat=1):
+    """Return the best time per product row (µs) of write_rows on an invoice of count products."""
+    products = make_products(count)
+    line_totals = compute_totals(products).line_totals
+    best = None
+    for _ in range(repeat):
+        ws, row_styles = new_sheet()
+        start = time.perf_counter()
+        write_rows(ws, products, line_totals, row_styles)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+
+#--------------------------------------------------merged cells--------------------------------------------------
+def merge_cells_per_row(ws, products, line_totals, row_styles):
+    """Product rows merged with one ws.merge_cells call per range, as generate_invoice used to do."""
+    row = FIRST_PRODUCT_ROW
+    for product, total in zip(products, line_totals):
+        ws[f'A{row}'] = product["Quantité"]
+        ws.merge_cells(f'B{row}:E{row}')
+        ws[f'B{row}'] = product["Nom du produit"]
+        ws.merge_cells(f'F{row}:G{row}')
+        ws[f'F{row}'] = product["Prix unitaire"]
+        ws.merge_cells(f'H{row}:I{row}')
+        ws[f'H{row}'] = total
+        for column, style in enumerate(row_styles, start=1):
+            apply_style(ws.cell(row, column), style)
+        row += 1
+
+
+def bench_merges():
+    # merge_cells compares each new range with all the previous ones: its cost per row grows with the
+    # number of rows, while the range table of write_products stays flat
+    print("Merged cells, µs per product row")
+    print(f"{'rows':>8} {'merge_cells':>12} {'range table':>12}")
+    for count in (250, 1000, 2000, 4000):
+        print(f"{count:>8} {time_per_row(merge_cells_per_row, count):>12.1f} "
+              f"{time_per_row(write_products, count):>12.1f}")
+
+
+#--------------------------------------------------cell access--------------------------------------------------
+def a1_addresses(ws, products, line_totals, row_styles):
+    """Product rows written through f-string A1 addresses (ws[f'A{row}']), merges from the range table."""
+    cells = ws._cells
+    merged_ranges = []
+    row = FIRST_PRODUCT_ROW
+    for product, total in zip(products, line_totals):
+        for first_column, last_column in PRODUCT_ROW_MERGES:
+            merged_ranges.append(CellRange(min_col=first_column, min_row=row, max_col=last_column, max_row=row))
+            for column in range(first_column + 1, last_column + 1):
+                cells[row, column] = MergedCell(ws, row, column)
+        ws[f'A{row}'] = product["Quantité"]
+        ws[f'B{row}'] = product["Nom du produit"]
+        ws[f'F{row}'] = product["Prix unitaire"]
+        ws[f'H{row}'] = total
+        for column, style in enumerate(row_styles, start=1):
+            apply_style(ws.cell(row, column), style)
+        row += 1
+    ws.merged_cells = MultiCellRange([*ws.merged_cells.ranges, *merged_ranges])
+
+
+def bench_cell_access():
+    print("Cell access, µs per product row")
+    print(f"{'rows':>8} {'A1 strings':>12} {'(row, col)':>12}")
+    for count in (1000, 10000):
+        print(f"{count:>8} {time_per_row(a1_addresses, count, 5):>12.1f} "
+              f"{time_per_row(write_products, count, 5):>12.1f}")
+
+
+if __name__ == "__main__":
+    bench_merges()
+    print()
+    bench_cell_access()
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import client_store
+from client_store import ClientStore, ID_KEY, NAME_KEY
+
+# Checks of the client store journal, compaction and cross-instance locking: python check_client_store.py
+#
+# Each check runs on a fresh clients.json in a temporary directory, with several ClientStore instances
+# standing for several GUI or batch processes sharing the files. Exits with 1 if a check fails.
+
+PROCESS_COUNT = 4
+CLIENTS_PER_PROCESS = 100
+
+
+def client(name):
+    return {NAME_KEY: name, "Adresse_cp": "75001", "Adresse_ville": "Paris"}
+
+
+def names(store):
+    return sorted(record[NAME_KEY] for record in store)
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+#--------------------------------------------------checks--------------------------------------------------
+def check_torn_journal_line(path):
+    """A journal line cut short by a crash is dropped, and edits appended after it are not lost."""
+    store = ClientStore(path)
+    store.add(client("A"))
+    store.add(client("B"))
+    with open(store.journal_path, 'ab') as file:
+        file.write(b'{"op": "put", "client": {"id": 3, "Nom de l')
+    reopened = ClientStore(path)
+    check(names(reopened) == ["A", "B"], f"clients after a torn line: {names(reopened)}")
+    reopened.add(client("C"))
+    # The first instance takes in the repaired files before its own edit
+    store.add(client("D"))
+    check(names(ClientStore(path)) == ["A", "B", "C", "D"], f"clients after the repair: {names(ClientStore(path))}")
+
+
+def check_compaction_between_edits(path):
+    """An instance's edits and lazy reads stay right after another instance compacted the store."""
+    first = ClientStore(path)
+    second = ClientStore(path)
+    kept = first.add(client("A"))
+    first.compact()
+    second.add(client("B"))
+    # Snapshot rewritten under the first instance, which still has the offsets of the old one
+    second.compact()
+    updated = first.update(kept["id"], {"Adresse_ville": "Lyon"})
+    record = first.add(client("C"))
+    check(updated["Adresse_ville"] == "Lyon", "update after another instance's compaction")
+    check(first.find("b") is not None, "client added by the other instance not found")
+    reopened = ClientStore(path)
+    check(names(reopened) == ["A", "B", "C"], f"clients after compaction: {names(reopened)}")
+    check(sorted(reopened.ids()) == [1, 2, record["id"]] and record["id"] == 3, f"ids: {reopened.ids()}")
+    check(reopened.get(kept["id"])["Adresse_ville"] == "Lyon", "update lost by the compaction")
+
+
+def check_no_id_reuse(path):
+    """The id of a deleted client, even the highest one, is never given again."""
+    first = ClientStore(path)
+    second = ClientStore(path)
+    for name in "ABC":
+        first.add(client(name))
+    first.delete(3)
+    check(second.add(client("D"))[ID_KEY] == 4, "id of a client deleted by another instance reused")
+    second.delete(4)
+    second.compact()
+    check(ClientStore(path).add(client("E"))[ID_KEY] == 5, "id of a deleted client reused after compaction")
+
+
+def add_clients(path, tag):
+    # Compacts often, so that compactions interleave with the other processes' appends
+    client_store.COMPACT_AFTER = 7
+    store = ClientStore(path)
+    for index in range(CLIENTS_PER_PROCESS):
+        store.add(client(f"{tag} {index}"))
+        store.save()
+
+
+def check_concurrent_processes(path):
+    """Processes adding clients at the same time lose none and never share an id."""
+    processes = [multiprocessing.Process(target=add_clients, args=(path, tag)) for tag in range(PROCESS_COUNT)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    check(all(process.exitcode == 0 for process in processes), "a process failed")
+    store = ClientStore(path)
+    count = PROCESS_COUNT * CLIENTS_PER_PROCESS
+    check(len(set(names(store))) == count, f"{len(set(names(store)))} clients of {count}")
+    check(sorted(store.ids()) == list(range(1, count + 1)), "ids duplicated or skipped")
+
+
+CHECKS = [check_torn_journal_line, check_compaction_between_edits, check_no_id_reuse, check_concurrent_processes]
+
+
+def main():
+    failed = 0
+    for check_store in CHECKS:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                check_store(os.path.join(directory, 'clients.json'))
+            except AssertionError as error:
+                print(f"FAIL {check_store.__name__}: {error}")
+                failed += 1
+            else:
+                print(f"ok   {check_store.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import argparse
+import re
+import sys
+from collections import defaultdict
+from functools import lru_cache
+from client_search import normalize_text
+from client_store import ClientStore, ID_KEY, NAME_KEY
+
+# Fuzzy detection of duplicate clients ("ITI Informatique" / "iti informatique sarl").
+#
+# Names are compared as sets of normalized tokens, without accents, punctuation and legal forms.
+# A saved client is a duplicate candidate of a new one when:
+#   - they have the same TVA number, or
+#   - their names have the same tokens, or
+#   - they have the same postcode and similar names: every token of the name with fewer tokens matches
+#     a token of the other, exactly or with one typo (letter added, dropped, replaced or swapped) for
+#     tokens of MIN_TYPO_LENGTH letters or more. "Boulangerie Dupond" / "Boulangerie Dupont",
+#     "Informatique ITY" / "ITI Informatique" and "ITI Informatique Paris" / "ITI Informatique" are
+#     similar; a one-token name only matches a one-token name ("ITI" is not "ITI Informatique").
+# Each rule is a dict lookup. The last one only compares the clients of one postcode sharing a block
+# key: a token, or a token with one letter deleted (two tokens one typo apart always share one).
+# A block of more than MAX_BLOCK_SIZE clients is skipped: its key is a word too common in that
+# postcode to tell clients apart ("tabac", "bar", "paris" in a Paris postcode), and comparing with all
+# of them would make each check grow with the number of clients. A check thus compares at most
+# MAX_BLOCK_SIZE clients per block key of the new name. The limit: two names whose only shared or
+# one-typo-apart words are that common in their postcode ("Bar Tabac" / "Bar Tabak") are not found
+# similar, though still found with the same tokens or TVA number.
+#
+# Batch mode lists (or merges) the duplicates of a whole clients file:
+#   python client_dedupe.py clients.json [--merge]
+
+# Legal forms and filler words that do not tell two companies apart
+IGNORED_TOKENS = {
+    "sarl", "sas", "sasu", "sa", "eurl", "snc", "sci", "scop", "ei", "eirl", "gie", "selarl",
+    "ste", "societe", "ets", "etablissements", "cie", "et", "and", "the", "de", "la", "le", "les", "du", "des",
+}
+
+# Shorter tokens must match exactly
+MIN_TYPO_LENGTH = 3
+# Clients of a (postcode, block key) block above which the block is not looked at
+MAX_BLOCK_SIZE = 50
+
+
+def name_tokens(name):
+    # Dots dropped first so that "S.A.R.L." is one token
+    tokens = re.sub(r"[\W_]+", " ", normalize_text(name).replace(".", "")).split()
+    meaningful = [token for token in tokens if token not in IGNORED_TOKENS]
+    # A name made only of ignored words is still compared on them
+    return tuple(sorted(set(meaningful or tokens)))
+
+
+def normalize_tva_number(tva_number):
+    return re.sub(r"[\W_]+", "", tva_number).upper()
+
+
+def normalize_postcode(postcode):
+    return "".join(postcode.split())
+
+
+def within_one_typo(token, other):
+    """True if the tokens differ by at most one letter added, dropped, replaced or swapped with the next."""
+    if token == other:
+        return True
+    if len(token) > len(other):
+        token, other = other, token
+    if len(other) - len(token) > 1:
+        return False
+    start = 0
+    while start < len(token) and token[start] == other[start]:
+        start += 1
+    if len(token) < len(other):
+        return token[start:] == other[start + 1:]
+    return (token[start + 1:] == other[start + 1:]
+            or (token[start:start + 2] == other[start:start + 2][::-1] and token[start + 2:] == other[start + 2:]))
+
+
+def tokens_match(token, other):
+    if token == other:
+        return True
+    return min(len(token), len(other)) >= MIN_TYPO_LENGTH and within_one_typo(token, other)
+
+
+def names_similar(tokens, other_tokens):
+    """True if every token of the name with fewer tokens matches a token of the other (see above)."""
+    short, long = sorted((tokens, other_tokens), key=len)
+    if len(short) == 1 and len(long) > 1:
+        return False
+    return all(any(tokens_match(token, other) for other in long) for token in short)
+
+
+# Names share most of their words (trades, towns): the keys of a token are computed once
+@lru_cache(maxsize=65536)
+def block_keys(token):
+    """The token and, from MIN_TYPO_LENGTH letters, the token with each letter deleted in turn."""
+    if len(token) < MIN_TYPO_LENGTH:
+        return frozenset([token])
+    return frozenset([token, *(token[:position] + token[position + 1:] for position in range(len(token)))])
+
+
+def name_block_keys(tokens):
+    if len(tokens) == 1:
+        return block_keys(tokens[0])
+    return frozenset().union(*map(block_keys, tokens))
+
+
+class DuplicateIndex:
+    """Index of saved clients by TVA number, name tokens and (postcode, block key) blocks."""
+
+    def __init__(self, clients=()):
+        self.keys = {}
+        self.by_tva_number = defaultdict(set)
+        self.by_tokens = defaultdict(set)
+        # postcode -> block key -> ids
+        self.by_block = defaultdict(lambda: defaultdict(set))
+        for client in clients:
+            self.add(client)
+
+    @staticmethod
+    def client_keys(client):
+        return (name_tokens(client.get(NAME_KEY, "")), normalize_tva_number(client.get("Num_TVA", "")),
+                normalize_postcode(client.get("Adresse_cp", "")))
+
+    def add(self, client):
+        """Index a saved client record, replacing the previous version of the same id."""
+        client_id = client[ID_KEY]
+        self.remove(client_id)
+        tokens, tva_number, postcode = self.keys[client_id] = self.client_keys(client)
+        if tva_number:
+            self.by_tva_number[tva_number].add(client_id)
+        self.by_tokens[tokens].add(client_id)
+        if postcode:
+            blocks = self.by_block[postcode]
+            for key in name_block_keys(tokens):
+                blocks[key].add(client_id)
+
+    def remove(self, client_id):
+        keys = self.keys.pop(client_id, None)
+        if keys is None:
+            return
+        tokens, tva_number, postcode = keys
+        self._discard(self.by_tva_number, tva_number, client_id)
+        self._discard(self.by_tokens, tokens, client_id)
+        blocks = self.by_block.get(postcode)
+        if blocks is not None:
+            for key in name_block_keys(tokens):
+                self._discard(blocks, key, client_id)
+            if not blocks:
+                del self.by_block[postcode]
+
+    @staticmethod
+    def _discard(index, key, client_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(client_id)
+            if not ids:
+                del index[key]
+
+    def find_duplicates(self, client):
+        """Return the (id, reason) of the saved clients that are probably client, best reasons first.
+
+        reason is "tva" (same TVA number), "name" (same name tokens) or "similar" (similar name, same
+        postcode). The client itself (same id) is never returned.
+        """
+        tokens, tva_number, postcode = self.client_keys(client)
+        found = {}
+        if tva_number:
+            for client_id in self.by_tva_number.get(tva_number, ()):
+                found.setdefault(client_id, "tva")
+        for client_id in self.by_tokens.get(tokens, ()):
+            found.setdefault(client_id, "name")
+        if postcode:
+            candidates = set()
+            blocks = self.by_block.get(postcode, {})
+            for key in name_block_keys(tokens):
+                block = blocks.get(key, ())
+                if len(block) <= MAX_BLOCK_SIZE:
+                    candidates.update(block)
+            for client_id in candidates - found.keys():
+                if names_similar(tokens, self.keys[client_id][0]):
+                    found[client_id] = "similar"
+        found.pop(client.get(ID_KEY), None)
+        return sorted(found.items(), key=lambda item: (["tva", "name", "similar"].index(item[1]), item[0]))
+
+
+def duplicate_groups(clients):
+    """Group the clients that are duplicates of one another (transitively), by id. Groups of one are left out."""
+    index = DuplicateIndex()
+    parent = {}
+
+    def root(client_id):
+        while parent[client_id] != client_id:
+            parent[client_id] = parent[parent[client_id]]
+            client_id = parent[client_id]
+        return client_id
+
+    for client in clients:
+        client_id = client[ID_KEY]
+        parent[client_id] = client_id
+        for duplicate_id, reason in index.find_duplicates(client):
+            parent[root(duplicate_id)] = root(client_id)
+        index.add(client)
+
+    groups = defaultdict(list)
+    for client_id in parent:
+        groups[root(client_id)].append(client_id)
+    return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def merge_group(client_store, group):
+    """Keep the oldest client of a duplicate group, completing its empty fields from the others, and delete the others."""
+    kept = client_store.get(group[0])
+    completed = {}
+    for client_id in group[1:]:
+        duplicate = client_store.get(client_id)
+        for key, value in duplicate.items():
+            if key != ID_KEY and value and not kept.get(key) and key not in completed:
+                completed[key] = value
+        client_store.delete(client_id)
+    if completed:
+        client_store.update(kept[ID_KEY], completed)
+    return kept[ID_KEY]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the duplicate clients of a clients file.")
+    parser.add_argument("clients", nargs="?", default="clients.json", help="saved clients file")
+    parser.add_argument("--merge", action="store_true",
+                        help="keep the oldest client of each group and delete the others")
+    args = parser.parse_args(argv)
+
+    client_store = ClientStore(args.clients)
+    groups = duplicate_groups(client_store.summaries())
+    for group in groups:
+        print(" | ".join(f"{client_id}: {client_store.summary(client_id)[NAME_KEY]}" for client_id in group))
+    if args.merge and groups:
+        for group in groups:
+            merge_group(client_store, group)
+        client_store.compact()
+        print(f"{sum(len(group) - 1 for group in groups)} duplicate clients merged")
+    else:
+        print(f"{len(groups)} groups of duplicate clients")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+from bisect import bisect_left, insort
+from PyQt5 import QtCore
+from client_search import MAX_RESULTS
+from client_store import NAME_KEY
+
+# Qt models of the client picker (ClientsWindow).
+#
+# ClientListModel exposes every saved client as one row, but the view only asks for the rows it
+# shows: no item object is built per client. ClientSearchProxyModel filters it through the search
+# index (client_search.py) instead of testing every row, so a keystroke costs one index lookup and
+# a remap of at most MAX_RESULTS rows.
+#
+# BackgroundClientSearch runs those lookups on a worker thread once typing pauses for
+# SEARCH_DELAY_MS. Each query gets a generation number: a query is skipped if a newer one was
+# requested before it started, and its results are dropped if a newer one was requested meanwhile.
+# The worker thread is stopped by stop(), and otherwise when the search object is destroyed (with its
+# window) or the application quits: a QThread destroyed while running aborts the process.
+
+CLIENT_ID_ROLE = QtCore.Qt.UserRole
+CLIENT_ROLE = QtCore.Qt.UserRole + 1
+
+SEARCH_DELAY_MS = 150
+
+
+class ClientListModel(QtCore.QAbstractListModel):
+    """All the clients of a client store, in id order."""
+
+    def __init__(self, client_store, parent=None):
+        super().__init__(parent)
+        self.client_store = client_store
+        self.ids = client_store.ids()
+        # Row of each id when the model was built, never rebuilt: the current row is that row minus the
+        # rows removed before it (removed_rows, sorted rows of the same numbering)
+        self.rows = {client_id: row for row, client_id in enumerate(self.ids)}
+        self.removed_rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        client_id = self.ids[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            # From the summary: shown rows do not need their full record parsed
+            return self.client_store.summary(client_id)[NAME_KEY]
+        if role == CLIENT_ID_ROLE:
+            return client_id
+        if role == CLIENT_ROLE:
+            return self.client_store.get(client_id)
+        return None
+
+    def row_of(self, client_id):
+        first_row = self.rows.get(client_id)
+        return None if first_row is None else first_row - bisect_left(self.removed_rows, first_row)
+
+    def remove_client(self, client_id):
+        """Remove a client's row, without renumbering the rows after it."""
+        row = self.row_of(client_id)
+        if row is None:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.ids[row]
+        insort(self.removed_rows, self.rows.pop(client_id))
+        self.endRemoveRows()
+
+
+class ClientSearchProxyModel(QtCore.QAbstractProxyModel):
+    """The rows of a ClientListModel matching the filter text, in search rank order.
+
+    An empty filter text shows every client.
+    """
+
+    def __init__(self, client_search, parent=None):
+        super().__init__(parent)
+        self.client_search = client_search
+        self.filter_text = ""
+        # Ids of the clients matching filter_text, in rank order
+        self.match_ids = []
+        # Source rows of the proxy rows, None when every source row is shown
+        self.source_rows = None
+        self.proxy_rows = {}
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        # The row mapping is rebuilt whenever the source rows move
+        for about_to_change in (model.modelAboutToBeReset, model.rowsAboutToBeRemoved, model.rowsAboutToBeInserted):
+            about_to_change.connect(self.beginResetModel)
+        for changed in (model.modelReset, model.rowsRemoved, model.rowsInserted):
+            changed.connect(self._source_rows_changed)
+        model.dataChanged.connect(self._source_data_changed)
+        self.set_filter_text(self.filter_text)
+
+    def set_filter_text(self, text):
+        """Search text and show its matches."""
+        self.set_matches(text, self.client_search.search(text, MAX_RESULTS) if text.strip() else [])
+
+    def set_matches(self, text, client_ids):
+        """Show the clients matching text, already searched (client_ids in rank order)."""
+        self.beginResetModel()
+        self.filter_text = text
+        self.match_ids = client_ids
+        self._map_rows()
+        self.endResetModel()
+
+    def _map_rows(self):
+        source = self.sourceModel()
+        if not self.filter_text.strip() or source is None:
+            self.source_rows = None
+            self.proxy_rows = {}
+            return
+        # Ids no longer in the source (deleted clients) are dropped
+        rows = (source.row_of(client_id) for client_id in self.match_ids)
+        self.source_rows = [row for row in rows if row is not None]
+        self.proxy_rows = {source_row: row for row, source_row in enumerate(self.source_rows)}
+
+    def _source_rows_changed(self, *args):
+        self._map_rows()
+        self.endResetModel()
+
+    def _source_data_changed(self, top_left, bottom_right, roles=()):
+        for source_row in range(top_left.row(), bottom_right.row() + 1):
+            index = self.mapFromSource(self.sourceModel().index(source_row, 0))
+            if index.isValid():
+                self.dataChanged.emit(index, index, roles)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        if self.source_rows is None:
+            return self.sourceModel().rowCount()
+        return len(self.source_rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def index(self, row, column=0, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not 0 <= row < self.rowCount() or column != 0:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        return QtCore.QModelIndex()
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid() or self.sourceModel() is None:
+            return QtCore.QModelIndex()
+        row = proxy_index.row()
+        source_row = row if self.source_rows is None else self.source_rows[row]
+        return self.sourceModel().index(source_row, 0)
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QtCore.QModelIndex()
+        if self.source_rows is None:
+            return self.createIndex(source_index.row(), 0)
+        row = self.proxy_rows.get(source_index.row())
+        return QtCore.QModelIndex() if row is None else self.createIndex(row, 0)
+
+
+class ClientSearchWorker(QtCore.QObject):
+    """Searches of BackgroundClientSearch, run on its worker thread."""
+
+    finished = QtCore.pyqtSignal(int, str, list)
+
+    def __init__(self, client_search):
+        super().__init__()
+        self.client_search = client_search
+        # Generation of the last requested query, set from the GUI thread
+        self.latest_generation = 0
+
+    @QtCore.pyqtSlot(int, str)
+    def search(self, generation, text):
+        if generation != self.latest_generation:
+            # A newer query is already queued behind this one
+            return
+        client_ids = self.client_search.search(text, MAX_RESULTS)
+        if generation == self.latest_generation:
+            self.finished.emit(generation, text, client_ids)
+
+
+class BackgroundClientSearch(QtCore.QObject):
+    """Filter a ClientSearchProxyModel from a worker thread, SEARCH_DELAY_MS after the last keystroke."""
+
+    requested = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, proxy, client_search, parent=None):
+        super().__init__(parent)
+        self.proxy = proxy
+        self.text = ""
+        self.generation = 0
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(SEARCH_DELAY_MS)
+        self.timer.timeout.connect(self._start_search)
+
+        self.thread = QtCore.QThread(self)
+        self.worker = ClientSearchWorker(client_search)
+        self.worker.moveToThread(self.thread)
+        self.requested.connect(self.worker.search)
+        self.worker.finished.connect(self._search_finished)
+        # Not bound to self: still called while self is being destroyed, before its child thread is
+        thread = self.thread
+        self.destroyed.connect(lambda: stop_thread(thread))
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.stop)
+        self.thread.start()
+
+    def set_text(self, text):
+        self.text = text
+        if not text.strip():
+            # Every client is shown: nothing to search, and pending results are stale
+            self.timer.stop()
+            self._next_generation()
+            self.proxy.set_matches(text, [])
+            return
+        self.timer.start()
+
+    def _next_generation(self):
+        self.generation += 1
+        self.worker.latest_generation = self.generation
+        return self.generation
+
+    def _start_search(self):
+        self.requested.emit(self._next_generation(), self.text)
+
+    def _search_finished(self, generation, text, client_ids):
+        if generation == self.generation:
+            self.proxy.set_matches(text, client_ids)
+
+    def stop(self):
+        self.timer.stop()
+        self._next_generation()
+        stop_thread(self.thread)
+
+
+def stop_thread(thread):
+    thread.quit()
+    thread.wait()
@@ -0,0 +1,168 @@
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import islice
+from operator import itemgetter
+from client_store import ID_KEY, NAME_KEY
+
+# Search index of the client picker (ClientsWindow), over the company name, the city and the TVA number.
+#
+# Matches are ranked in tiers, each sorted by name:
+#   1. the name starts with the query
+#   2. a word of the name starts with the query
+#   3. the name contains the query (queries of 3 characters or more, through a trigram index)
+#   4. a word of the city or of the TVA number starts with the query
+# Tiers 1, 2 and 4 are ranges of sorted lists found by bisection, so the best MAX_RESULTS matches
+# are read in order without looking at the other clients.
+#
+# Searches may run on a worker thread (see client_models.py) while the GUI thread adds or removes
+# clients: both go through the index lock.
+
+MAX_RESULTS = 50
+
+
+def normalize_text(text):
+    """Lowercase without accents, so that "evry" finds "Évry"."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return " ".join("".join(char for char in text if not unicodedata.combining(char)).split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def prefix_range(entries, prefix):
+    """Yield the entries of a sorted list of tuples whose first item starts with prefix."""
+    index = bisect_left(entries, (prefix,))
+    while index < len(entries) and entries[index][0].startswith(prefix):
+        yield entries[index]
+        index += 1
+
+
+def word_matches(words, prefix, limit):
+    """Yield the (word, name, id) entries whose word starts with prefix, by name.
+
+    The entries of one word are already sorted by name: the runs of the matching words are merged,
+    reading at most limit entries of each.
+    """
+    runs = []
+    index = bisect_left(words, (prefix,))
+    while index < len(words) and words[index][0].startswith(prefix):
+        # "\0" sorts before any character: the end of the run of this exact word
+        end = bisect_left(words, (words[index][0] + "\0",), index)
+        runs.append(words[index:min(end, index + limit)])
+        index = end
+    return heapq.merge(*runs, key=itemgetter(1))
+
+
+class ClientSearchIndex:
+    """Name, word and trigram indexes of client records, kept up to date with add and remove."""
+
+    def __init__(self, clients=()):
+        self.lock = threading.Lock()
+        self.fields = {}
+        self.names = []
+        self.name_words = []
+        self.other_words = []
+        self.trigram_index = defaultdict(set)
+        for client in clients:
+            names, name_words, other_words = self._index(client)
+            self.names.extend(names)
+            self.name_words.extend(name_words)
+            self.other_words.extend(other_words)
+        # Sorted once, rather than an insort per entry
+        self.names.sort()
+        self.name_words.sort()
+        self.other_words.sort()
+
+    def __len__(self):
+        return len(self.fields)
+
+    def _entries(self, client_id):
+        name, city, tva_number = self.fields[client_id]
+        return (
+            [(name, client_id)],
+            [(word, name, client_id) for word in set(name.split())],
+            [(word, name, client_id) for word in set(city.split()) | set(tva_number.split())],
+        )
+
+    def _index(self, client):
+        """Index the trigrams of client and return its entries of the sorted lists."""
+        client_id = client[ID_KEY]
+        self.fields[client_id] = (normalize_text(client.get(NAME_KEY, "")),
+                                  normalize_text(client.get("Adresse_ville", "")),
+                                  normalize_text(client.get("Num_TVA", "")))
+        for trigram in trigrams(self.fields[client_id][0]):
+            self.trigram_index[trigram].add(client_id)
+        return self._entries(client_id)
+
+    def add(self, client):
+        """Index a client record, replacing the previous version of the same id."""
+        with self.lock:
+            if client[ID_KEY] in self.fields:
+                self._remove(client[ID_KEY])
+            for entries, new_entries in zip((self.names, self.name_words, self.other_words), self._index(client)):
+                for entry in new_entries:
+                    insort(entries, entry)
+
+    def remove(self, client_id):
+        with self.lock:
+            self._remove(client_id)
+
+    def _remove(self, client_id):
+        if client_id not in self.fields:
+            return
+        for entries, old_entries in zip((self.names, self.name_words, self.other_words), self._entries(client_id)):
+            for entry in old_entries:
+                index = bisect_left(entries, entry)
+                if index < len(entries) and entries[index] == entry:
+                    del entries[index]
+        for trigram in trigrams(self.fields.pop(client_id)[0]):
+            ids = self.trigram_index[trigram]
+            ids.discard(client_id)
+            if not ids:
+                del self.trigram_index[trigram]
+
+    def name_substring_matches(self, query, limit):
+        """The limit first (name, id) by name of the clients whose name contains query (3 characters or more)."""
+        # Smallest posting sets first: the intersection shrinks fastest
+        postings = sorted((self.trigram_index.get(trigram, set()) for trigram in trigrams(query)), key=len)
+        if len(postings[0]) ** 2 >= limit * len(self.names):
+            # A common query: reading the names in order finds limit matches after about
+            # limit * len(names) / len(matches) names, fewer than the candidates to intersect
+            return list(islice((entry for entry in self.names if query in entry[0]), limit))
+        ids = postings[0].intersection(*postings[1:])
+        # Sharing all the trigrams of the query does not mean containing it
+        fields = self.fields
+        return heapq.nsmallest(limit, ((fields[client_id][0], client_id) for client_id in ids
+                                       if query in fields[client_id][0]))
+
+    def search(self, text, limit=MAX_RESULTS):
+        """Return the ids of the best matches of text, at most limit of them.
+
+        An empty text returns the first clients by name.
+        """
+        query = normalize_text(text)
+        with self.lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        results = [client_id for name, client_id in islice(prefix_range(self.names, query), limit)]
+        seen = set(results)
+
+        def take(matches):
+            for client_id in islice((client_id for client_id in matches if client_id not in seen),
+                                    limit - len(results)):
+                results.append(client_id)
+                seen.add(client_id)
+
+        if len(results) < limit:
+            take(client_id for word, name, client_id in word_matches(self.name_words, query, limit))
+        if len(results) < limit and len(query) >= 3:
+            # The limit first: at most len(results) of them are already taken
+            take(client_id for name, client_id in self.name_substring_matches(query, limit))
+        if len(results) < limit:
+            take(client_id for word, name, client_id in word_matches(self.other_words, query, limit))
+        return results
@@ -0,0 +1,353 @@
+import json
+import os
+from invoice_numbers import LOCK_SUFFIX, file_lock
+
+# Saved clients, opened without parsing every record.
+#
+# clients.json stays a list of client records (same keys as before, plus a stable "id"), written one
+# record per line. Next to it, clients.json.idx gives the byte offset and length of each record with
+# the fields the client search and duplicate indexes need (SUMMARY_FIELDS). Opening the store reads
+# only that index: a full record is read from its offset the first time get() asks for it. An index
+# that is missing or older than clients.json (edited by hand, written by an older version) is rebuilt
+# from a full parse once.
+#
+# Edits are not written by rewriting clients.json: each add/update/delete appends one line to the
+# journal clients.json.log, replayed over clients.json when the store is loaded. Once the journal
+# has COMPACT_AFTER entries, save() compacts it into a new clients.json snapshot and index.
+#
+# Several instances may share the files (GUI on a shared folder, batch runs). Every edit, compaction and
+# record read holds clients.json.lock, as invoiceNumber.json does (invoice_numbers.py), and first
+# takes in what the other instances wrote since: the journal lines appended after the last one read,
+# or the whole store again if another instance compacted it.
+
+CLIENT_FIELDS = ["Nom de l'entreprise", "Adresse", "Adresse_cp", "Adresse_ville", "Contact", "Num_TVA"]
+NAME_KEY = "Nom de l'entreprise"
+ID_KEY = "id"
+# Fields of the index file, read without the full records
+SUMMARY_FIELDS = ["Nom de l'entreprise", "Adresse_cp", "Adresse_ville", "Num_TVA"]
+
+JOURNAL_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+COMPACT_AFTER = 200
+
+
+def normalize_name(name):
+    """Key of the name index: case and surrounding/repeated spaces do not make a different client."""
+    return " ".join(name.split()).casefold()
+
+
+class ClientStore:
+    """Client records by id, with an index by normalized company name."""
+
+    def __init__(self, path='clients.json'):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.index_path = path + INDEX_SUFFIX
+        self.lock_path = path + LOCK_SUFFIX
+        self.journal_entries = 0
+        # Bytes of the journal already replayed, and (size, mtime) of the snapshot that was read
+        self.journal_size = 0
+        self.snapshot_stat = None
+        # Summary (id and SUMMARY_FIELDS) of every client, in id order
+        self.summaries_by_id = {}
+        # Full records already parsed or edited, and snapshot (offset, length) of the others
+        self.clients = {}
+        self.locations = {}
+        self.name_index = {}
+        self.next_id = 1
+        self.load()
+
+    def load(self):
+        with file_lock(self.lock_path):
+            self._load()
+
+    def _load(self):
+        """Read the snapshot and the whole journal. Called under the store lock."""
+        self.summaries_by_id = {}
+        self.clients = {}
+        self.locations = {}
+        self.name_index = {}
+        self.journal_entries = 0
+        self.journal_size = 0
+        indexed = self.load_index()
+        if not indexed:
+            self.load_snapshot()
+        self.snapshot_stat = self._snapshot_stat()
+        broken = self.replay_journal()
+        if broken or (not indexed and os.path.exists(self.path)):
+            # Written once in the indexed format, so that the next loads skip the full parse
+            self._compact()
+
+    def _snapshot_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def load_index(self):
+        """Read the summaries and offsets of the snapshot records. Return False if the index cannot be used."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            stat = os.stat(self.path)
+        except (FileNotFoundError, ValueError):
+            return False
+        if (index.get("fields") != SUMMARY_FIELDS or index.get("size") != stat.st_size
+                or index.get("mtime_ns") != stat.st_mtime_ns):
+            return False
+        summaries = index["clients"]
+        self.summaries_by_id = {summary[ID_KEY]: summary for summary in summaries}
+        self.locations = dict(zip(self.summaries_by_id, map(tuple, index["locations"])))
+        self.name_index = {normalize_name(summary[NAME_KEY]): summary[ID_KEY] for summary in summaries}
+        self.next_id = max(self.summaries_by_id, default=0) + 1
+        return True
+
+    def load_snapshot(self):
+        """Parse every record of the snapshot."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                content = file.read().strip()
+                records = json.loads(content) if content else []
+        except FileNotFoundError:
+            records = []
+        self.next_id = max((record.get(ID_KEY, 0) for record in records), default=0) + 1
+        for record in records:
+            if ID_KEY not in record:
+                # Records saved before ids existed get one, written by the compaction that follows
+                record[ID_KEY] = self.next_id
+                self.next_id += 1
+            self._insert(record)
+
+    def replay_journal(self):
+        """Apply the journal entries appended since the last replay. Return True if it ends with a broken line."""
+        broken = False
+        try:
+            file = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return broken
+        with file:
+            file.seek(self.journal_size)
+            for line in file:
+                try:
+                    entry = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    # Last append cut short (crash, full disk): the edit was never completed. The
+                    # caller compacts once the journal is closed, so that new entries do not follow it
+                    broken = True
+                    break
+                self._apply(entry)
+                self.journal_entries += 1
+                self.journal_size += len(line)
+        return broken
+
+    def _apply(self, entry):
+        if entry["op"] == "put":
+            record = entry["client"]
+            if record[ID_KEY] in self.summaries_by_id:
+                self._unindex(record[ID_KEY])
+            self._insert(record)
+            self.next_id = max(self.next_id, record[ID_KEY] + 1)
+        elif entry["op"] == "next_id":
+            self.next_id = max(self.next_id, entry["id"])
+        else:
+            self._remove(entry["id"])
+
+    def _catch_up(self):
+        """Take in the edits of the other instances since this one last read the files. Called under the store lock."""
+        try:
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            journal_size = 0
+        if self._snapshot_stat() != self.snapshot_stat or journal_size < self.journal_size:
+            # Compacted by another instance: its snapshot holds every client, the journal started over
+            self._load()
+        elif self.replay_journal():
+            self._compact()
+
+    def _log(self, entry):
+        """Append an entry to the journal. Called under the store lock, after _catch_up()."""
+        with open(self.journal_path, 'ab') as file:
+            file.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+            self.journal_size = file.tell()
+        self.journal_entries += 1
+
+    def save(self):
+        """Edits are already in the journal: compact it once it has grown long enough."""
+        if self.journal_entries >= COMPACT_AFTER:
+            self.compact()
+
+    def compact(self):
+        """Write all the clients to a new clients.json snapshot and index, and empty the journal."""
+        with file_lock(self.lock_path):
+            # The journal may have entries of other instances: they go in the snapshot too
+            self._catch_up()
+            self._compact()
+
+    def _compact(self):
+        self._parse(list(self.summaries_by_id))
+        records = [self.clients[client_id] for client_id in self.summaries_by_id]
+        locations = {}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(b"[\n")
+            offset = 2
+            for position, record in enumerate(records):
+                data = json.dumps(record, ensure_ascii=False).encode('utf-8')
+                separator = b",\n" if position < len(records) - 1 else b"\n"
+                locations[record[ID_KEY]] = (offset, len(data))
+                file.write(data + separator)
+                offset += len(data) + len(separator)
+            file.write(b"]\n")
+        os.replace(temp_path, self.path)
+        self.snapshot_stat = self._snapshot_stat()
+        self.write_index(locations)
+        # Replaying the journal over the new snapshot would give the same clients: only dropped
+        # once the snapshot is in place
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_entries = 0
+        self.journal_size = 0
+        if self.next_id > max(self.summaries_by_id, default=0) + 1:
+            # The last ids belong to deleted clients: keep them from being given again
+            self._log({"op": "next_id", "id": self.next_id})
+        # The records are read back from the new snapshot when asked for
+        self.clients = {}
+        self.locations = locations
+
+    def write_index(self, locations):
+        stat = os.stat(self.path)
+        index = {
+            "fields": SUMMARY_FIELDS,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "clients": list(self.summaries_by_id.values()),
+            "locations": [locations[client_id] for client_id in self.summaries_by_id],
+        }
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, self.index_path)
+
+    def _index_summary(self, summary):
+        self.summaries_by_id[summary[ID_KEY]] = summary
+        self.name_index[normalize_name(summary[NAME_KEY])] = summary[ID_KEY]
+
+    def _insert(self, record):
+        self.clients[record[ID_KEY]] = record
+        self.locations.pop(record[ID_KEY], None)
+        self._index_summary({field: record.get(field, "") for field in SUMMARY_FIELDS} | {ID_KEY: record[ID_KEY]})
+
+    def _unindex(self, client_id):
+        name = normalize_name(self.summaries_by_id[client_id][NAME_KEY])
+        # clients.json may hold older duplicates of a name: the index points to one of them only
+        if self.name_index.get(name) == client_id:
+            del self.name_index[name]
+
+    def _remove(self, client_id):
+        if client_id in self.summaries_by_id:
+            self._unindex(client_id)
+            del self.summaries_by_id[client_id]
+            self.clients.pop(client_id, None)
+            self.locations.pop(client_id, None)
+
+    def _parse(self, client_ids):
+        """Read the snapshot records of client_ids not parsed yet. Called under the store lock."""
+        client_ids = [client_id for client_id in client_ids if client_id in self.locations]
+        if not client_ids:
+            return
+        with open(self.path, 'rb') as file:
+            for client_id in client_ids:
+                offset, length = self.locations.pop(client_id)
+                file.seek(offset)
+                self.clients[client_id] = json.loads(file.read(length))
+
+    def __len__(self):
+        return len(self.summaries_by_id)
+
+    def __iter__(self):
+        """Full records of every client (parsing those not read yet)."""
+        with file_lock(self.lock_path):
+            self._catch_up()
+            self._parse(list(self.summaries_by_id))
+            return iter([self.clients[client_id] for client_id in self.summaries_by_id])
+
+    def ids(self):
+        return list(self.summaries_by_id)
+
+    def summaries(self):
+        """Id and SUMMARY_FIELDS of every client, without parsing the full records."""
+        return iter(self.summaries_by_id.values())
+
+    def summary(self, client_id):
+        return self.summaries_by_id.get(client_id)
+
+    def get(self, client_id):
+        """Current record of a client, with the edits of the other instances, or None if it was deleted."""
+        # The file is only opened under the lock: on Windows an open file cannot be replaced by the
+        # compaction of another instance, and the offsets are those of the snapshot read
+        with file_lock(self.lock_path):
+            self._catch_up()
+            self._parse([client_id])
+            return self.clients.get(client_id)
+
+    def find(self, name):
+        """Return the client record with this company name (normalized), or None."""
+        client_id = self.name_index.get(normalize_name(name))
+        return None if client_id is None else self.get(client_id)
+
+    # Edits are made under the store lock, over the edits of the other instances: ids are given once
+    # and a compaction never drops a journal entry it has not seen.
+    def add(self, client):
+        """Add a new client record and return it with its id."""
+        with file_lock(self.lock_path):
+            self._catch_up()
+            return self._add(client)
+
+    def update(self, client_id, client):
+        """Update the fields of a client record, keeping its id, and return it."""
+        with file_lock(self.lock_path):
+            self._catch_up()
+            return self._update(client_id, client)
+
+    def delete(self, client_id):
+        with file_lock(self.lock_path):
+            self._catch_up()
+            record = self._record(client_id)
+            self._remove(client_id)
+            self._log({"op": "delete", "id": client_id})
+        return record
+
+    def upsert(self, client):
+        """Add the client, or update the saved client with the same name. Return the saved record."""
+        with file_lock(self.lock_path):
+            self._catch_up()
+            client_id = self.name_index.get(normalize_name(client[NAME_KEY]))
+            if client_id is None:
+                return self._add(client)
+            return self._update(client_id, client)
+
+    def _record(self, client_id):
+        self._parse([client_id])
+        if client_id not in self.clients:
+            # Deleted meanwhile by another instance
+            raise KeyError(client_id)
+        return self.clients[client_id]
+
+    def _add(self, client):
+        record = {key: client.get(key, "") for key in CLIENT_FIELDS}
+        record[ID_KEY] = self.next_id
+        self.next_id += 1
+        self._insert(record)
+        self._log({"op": "put", "client": record})
+        return record
+
+    def _update(self, client_id, client):
+        record = self._record(client_id)
+        self._unindex(client_id)
+        record.update({key: client[key] for key in CLIENT_FIELDS if key in client})
+        self._insert(record)
+        self._log({"op": "put", "client": record})
+        return record
@@ -1,23 +1,32 @@
 import sys
-import json
 import os
+from datetime import datetime
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, \
     QPushButton, QListWidget, QStackedLayout, QComboBox, QMessageBox, QMenu, QSpacerItem, QSizePolicy, QInputDialog, \
-    QListWidgetItem
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from datetime import datetime
+    QListView
+from client_models import CLIENT_ID_ROLE, BackgroundClientSearch, ClientListModel, ClientSearchProxyModel
+from client_dedupe import DuplicateIndex
+from client_search import ClientSearchIndex
+from client_store import ClientStore, NAME_KEY, normalize_name
+from invoice_db import DEFAULT_DATABASE, InvoiceDatabase
+from invoice_ledger import InvoiceLedger
+from invoice_money import compute_totals, line_total
+from invoice_numbers import InvoiceNumberAllocator
+from invoice_output import InvoiceOutputManager
+from invoice_renderer import render_invoice, invoice_file_name, has_tva_number
 
 # creation of a class ClientsWindow to manage the client list
 class ClientsWindow(QWidget):
-    def __init__(self, saved_clients, on_client_selected, parent=None):
+    def __init__(self, client_store, client_search, on_client_selected, on_client_deleted, parent=None):
         super().__init__(parent)
         self.setWindowTitle("选择客户")
         self.setGeometry(200, 200, 400, 300)
 
-        self.saved_clients = saved_clients
+        self.client_store = client_store
+        self.client_search = client_search
         self.on_client_selected = on_client_selected
+        self.on_client_deleted = on_client_deleted
 
         layout = QVBoxLayout(self)
 
@@ -27,11 +36,17 @@ class ClientsWindow(QWidget):
         self.search_bar.textChanged.connect(self.filter_clients)
         layout.addWidget(self.search_bar)
 
-        # Add client list
-        self.clients_list = QListWidget()
+        # Add client list: the view only asks the models for the rows it shows
+        self.clients_model = ClientListModel(client_store, self)
+        self.clients_proxy = ClientSearchProxyModel(client_search, self)
+        self.clients_proxy.setSourceModel(self.clients_model)
+        # Searches run off the GUI thread once typing pauses
+        self.background_search = BackgroundClientSearch(self.clients_proxy, client_search, self)
+        self.clients_list = QListView()
+        self.clients_list.setUniformItemSizes(True)
+        self.clients_list.setModel(self.clients_proxy)
         self.clients_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.clients_list.customContextMenuRequested.connect(self.show_context_menu)
-        # Do not populate the list initially
         layout.addWidget(self.clients_list)
 
         # Add select button
@@ -40,14 +55,12 @@ class ClientsWindow(QWidget):
         layout.addWidget(select_button)
 
     def filter_clients(self, text):
-        """Filter the client list based on the search bar input."""
-        self.clients_list.clear()
-        for client in self.saved_clients:
-            if text.lower() in client["Nom de l'entreprise"].lower():
-                item = QListWidgetItem(client["Nom de l'entreprise"])
-                # Associate the client data with the QListWidgetItem
-                item.setData(QtCore.Qt.UserRole, client)
-                self.clients_list.addItem(item)
+        """Show the best matches of the search bar input (name, city or TVA number)."""
+        self.background_search.set_text(text)
+
+    def closeEvent(self, event):
+        self.background_search.stop()
+        super().closeEvent(event)
 
     def show_context_menu(self, position):
         menu = QMenu()
@@ -58,25 +71,28 @@ class ClientsWindow(QWidget):
             self.delete_client()
 
     def delete_client(self):
-        selected_row = self.clients_list.currentRow()
-        if selected_row >= 0:
+        selected_index = self.clients_list.currentIndex()
+        if selected_index.isValid():
             reply = QMessageBox.question(self, "删除客户", "确定要删除这个客户吗？", QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.saved_clients.pop(selected_row)
-                self.clients_list.takeItem(selected_row)
+                client_id = selected_index.data(CLIENT_ID_ROLE)
+                try:
+                    self.client_store.delete(client_id)
+                except KeyError:
+                    # Already deleted by another instance: only dropped from this window
+                    pass
+                self.on_client_deleted(client_id)
+                self.clients_model.remove_client(client_id)
                 self.save_clients()
 
     def save_clients(self):
-        with open('clients.json', 'w') as file:
-            json.dump(self.saved_clients, file)
+        self.client_store.save()
 
     def select_client(self):
-        """Select the client and pass its data to the main window."""
-        selected_item = self.clients_list.currentItem()
-        if selected_item:
-            # Retrieve the client data associated with the selected item
-            selected_client = selected_item.data(QtCore.Qt.UserRole)
-            self.on_client_selected(selected_client)
+        """Select the client and pass its id to the main window."""
+        selected_index = self.clients_list.currentIndex()
+        if selected_index.isValid():
+            self.on_client_selected(selected_index.data(CLIENT_ID_ROLE))
             self.close()
 
 class MainWindow(QMainWindow):
@@ -93,32 +109,36 @@ class MainWindow(QMainWindow):
         self.layout.addLayout(self.stacked_layout)
 
         self.client_info = {}
+        # Id of the saved client picked in the ClientsWindow, updated in place when its fields are edited
+        self.selected_client_id = None
         self.products = []
-        self.saved_clients = []
         self.save_directory = ""
 
-        self.load_saved_clients()
+        # Clients, invoice numbers and issued invoices are kept in the SQLite database once the JSON
+        # files have been imported into it (python invoice_db.py), in the JSON files otherwise
+        self.database = InvoiceDatabase(DEFAULT_DATABASE) if os.path.exists(DEFAULT_DATABASE) else None
+        # Opened by load_saved_clients the first time clients are needed, not at startup
+        self.client_store = None
+        self.clients_window = None
+        self.invoice_numbers = self.database.invoice_numbers if self.database is not None else InvoiceNumberAllocator()
+        # Every generated invoice is appended to the ledger (factures.jsonl), whatever the storage
+        self.ledger = InvoiceLedger()
+        # Older invoice files are kept, deleted or archived into monthly zips in the background, as set in
+        # settings.json (see invoice_output.py)
+        try:
+            self.output_manager = InvoiceOutputManager.from_settings()
+        except ValueError as error:
+            QMessageBox.warning(self, "设置错误", f"settings.json: {error}\n\n发票文件将全部保留.")
+            self.output_manager = InvoiceOutputManager(policy="keep_all")
         self.load_invoice_number()
         self.create_client_info_page()
         self.create_product_info_page()
         self.create_payment_page()
 #--------------------------------------------------load invoice number--------------------------------------------------
-    # Load the invoice number from the JSON file
+    # Next free invoice number, shown until the invoice is generated: the number itself is only taken from
+    # the allocator then, so that other instances sharing invoiceNumber.json never issue the same one
     def load_invoice_number(self):
-        try:
-            with open('invoiceNumber.json', 'r') as file:
-                content = file.read().strip()
-                if content:
-                    data = json.loads(content)
-                    self.invoice_number = data.get('invoice_number', 1)
-                else:
-                    self.invoice_number = 1
-        except FileNotFoundError:
-            self.invoice_number = 1
-
-    def save_invoice_number(self):
-        with open('invoiceNumber.json', 'w') as file:
-            json.dump({'invoice_number': self.invoice_number}, file)
+        self.invoice_number = self.invoice_numbers.peek()
 
 
 #--------------------------------------------------create each page--------------------------------------------------
@@ -133,6 +153,8 @@ class MainWindow(QMainWindow):
 
         layout.addWidget(QLabel("客人商店名"))
         self.client_name_input = QLineEdit()
+        # Typing another name means another client than the one picked in the list
+        self.client_name_input.textEdited.connect(self.forget_selected_client)
         layout.addWidget(self.client_name_input)
 
         layout.addWidget(QLabel("客人商店 门牌号 和 街道名"))
@@ -273,28 +295,35 @@ class MainWindow(QMainWindow):
 
 #--------------------------------------------------clients Functions--------------------------------------------------
     def load_saved_clients(self):
-        try:
-            with open('clients.json', 'r') as file:
-                self.saved_clients = json.load(file)
-        except FileNotFoundError:
-            self.saved_clients = []
+        # Loaded once, when the clients window opens or an invoice is saved: lookups and upserts then
+        # go through the store's indexes. The search and duplicate indexes are built from the client
+        # summaries, full records are only read for the picked or matching clients.
+        if self.client_store is not None:
+            return
+        if self.database is not None:
+            self.client_store = self.database.clients
+        else:
+            self.client_store = ClientStore('clients.json')
+        self.client_search = ClientSearchIndex(self.client_store.summaries())
+        self.client_duplicates = DuplicateIndex(self.client_store.summaries())
 
     def save_client_if_not_exists(self, client_info):
-        try:
-            with open('clients.json', 'r') as file:
-                clients = json.load(file)
-        except FileNotFoundError:
-            clients = []
-
-        client_names = [client["Nom de l'entreprise"].strip().lower() for client in clients]
-        new_client_name = client_info["Nom de l'entreprise"].strip().lower()
-
-        if new_client_name in client_names:
-            existing_client = next(
-                client for client in clients if client["Nom de l'entreprise"].strip().lower() == new_client_name
-            )
-
+        """Save the client, asking before changing the picked or same-name saved client. Return the saved record."""
+        self.load_saved_clients()
+        existing_client = None
+        if self.selected_client_id is not None:
+            existing_client = self.client_store.get(self.selected_client_id)
+            if existing_client is None:
+                # Deleted by another instance since it was picked
+                self.forget_client(self.selected_client_id)
+        if existing_client is None:
+            existing_client = self.client_store.find(client_info["Nom de l'entreprise"])
+        if existing_client is None:
+            existing_client = self.ask_duplicate_client(client_info)
+
+        if existing_client is not None:
             key_mapping = {
+                NAME_KEY: "客人商店名",
                 "Adresse": "地址",
                 "Adresse_cp": "邮政编码",
                 "Adresse_ville": "城市",
@@ -303,6 +332,11 @@ class MainWindow(QMainWindow):
             }
 
             differences = []
+            # A picked client may have been renamed: the name is compared as the name index does
+            old_name = existing_client["Nom de l'entreprise"]
+            new_name = client_info["Nom de l'entreprise"]
+            if normalize_name(old_name) != normalize_name(new_name):
+                differences.append(f"{key_mapping[NAME_KEY]}: {old_name} -> {new_name}")
             for key in ["Adresse", "Adresse_cp", "Adresse_ville", "Contact", "Num_TVA"]:
                 if existing_client.get(key, "").strip() != client_info.get(key, "").strip():
                     chinese_key = key_mapping[key]
@@ -314,19 +348,72 @@ class MainWindow(QMainWindow):
                 reply = QMessageBox.question(self, "客户信息冲突", message, QMessageBox.Yes | QMessageBox.No)
 
                 if reply == QMessageBox.Yes:
-                    existing_client.update(client_info)
-                    with open('clients.json', 'w') as file:
-                        json.dump(clients, file, ensure_ascii=False, indent=4)
-        else:
-            clients.append(client_info)
-            with open('clients.json', 'w') as file:
-                json.dump(clients, file, ensure_ascii=False, indent=4)
+                    try:
+                        existing_client = self.client_store.update(existing_client["id"], client_info)
+                    except KeyError:
+                        # Deleted meanwhile by another instance: saved again as a new client
+                        self.forget_client(existing_client["id"])
+                        existing_client = None
+                    else:
+                        self.client_store.save()
+                        self.client_search.add(existing_client)
+                        self.client_duplicates.add(existing_client)
+            if existing_client is not None:
+                return existing_client
+        saved_client = self.client_store.add(client_info)
+        self.client_store.save()
+        self.client_search.add(saved_client)
+        self.client_duplicates.add(saved_client)
+        return saved_client
+
+    def ask_duplicate_client(self, client_info):
+        """Return the saved client that client_info probably is, if the user confirms it, else None."""
+        duplicates = self.client_duplicates.find_duplicates(client_info)
+        if not duplicates:
+            return None
+        candidate = self.client_store.get(duplicates[0][0])
+        if candidate is None:
+            # Deleted meanwhile by another instance
+            return None
+        new_name = client_info["Nom de l'entreprise"]
+        candidate_name = candidate["Nom de l'entreprise"]
+        # Clients saved by older versions may lack some fields
+        candidate_info = f"{candidate.get('Adresse_cp', '')} {candidate.get('Adresse_ville', '')}"
+        if candidate.get("Num_TVA"):
+            candidate_info += f", 税号 {candidate['Num_TVA']}"
+        message = f"{new_name} 可能是已有客户:\n{candidate_name} ({candidate_info})\n\n请问是否为同一客户 ?"
+        reply = QMessageBox.question(self, "可能重复的客户", message, QMessageBox.Yes | QMessageBox.No)
+        return candidate if reply == QMessageBox.Yes else None
+
+    def forget_client(self, client_id):
+        """Drop a deleted client from the search and duplicate indexes."""
+        self.client_search.remove(client_id)
+        self.client_duplicates.remove(client_id)
+        if client_id == self.selected_client_id:
+            self.selected_client_id = None
+
+    def forget_selected_client(self):
+        self.selected_client_id = None
 
     def show_clients_window(self):
-        self.clients_window = ClientsWindow(self.saved_clients, self.fill_client_info)
+        self.load_saved_clients()
+        if self.clients_window is not None and self.clients_window.isVisible():
+            # Already open: brought to the front rather than replaced
+            self.clients_window.raise_()
+            self.clients_window.activateWindow()
+            return
+        self.clients_window = ClientsWindow(self.client_store, self.client_search, self.fill_client_info,
+                                            self.forget_client)
         self.clients_window.show()
 
-    def fill_client_info(self, client):
+    def fill_client_info(self, client_id):
+        client = self.client_store.get(client_id)
+        if client is None:
+            # Deleted by another instance since the client list was opened
+            self.forget_client(client_id)
+            QMessageBox.warning(self, "错误", "该客户已被删除.")
+            return
+        self.selected_client_id = client_id
         self.client_name_input.setText(client["Nom de l'entreprise"])
         self.client_address_input.setText(client["Adresse"])
         self.client_address_cp_input.setText(client["Adresse_cp"])
@@ -348,6 +435,8 @@ class MainWindow(QMainWindow):
 
         try:
             product_price = float(product_price)
+            # Also rejects nan and inf, which float() accepts
+            price_total = line_total(int(product_quantity), product_price)
         except ValueError:
             QMessageBox.warning(self, "错误", "请输入正确价格.")
             self.product_price_input.clear()
@@ -358,7 +447,7 @@ class MainWindow(QMainWindow):
                 "Nom du produit": product_name,
                 "Quantité": int(product_quantity),
                 "Prix unitaire": product_price,
-                "Prix total": int(product_quantity) * product_price
+                "Prix total": price_total
             }
             self.products.append(product)
             self.product_list.addItem(
@@ -409,235 +498,40 @@ class MainWindow(QMainWindow):
         payment_method = self.payment_method_combo.currentData()
         self.client_info["Mode de paiement"] = payment_method
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Facture"
-
         # Save client info if not already in the JSON file
-        self.save_client_if_not_exists({
+        client = {
             "Nom de l'entreprise": self.client_name_input.text(),
             "Adresse": self.client_address_input.text(),
             "Adresse_cp": self.client_address_cp_input.text(),
             "Adresse_ville": self.client_address_ville_input.text(),
             "Contact": self.client_contact_input.text(),
             "Num_TVA": self.client_tva_input.text()
-        })
-
-        # Add invoice number
-        invoice_number = self.client_info["Numéro de facture"]
-        ws.merge_cells('A1:I1')
-        cell = ws['A1']
-        cell.value = f"FACTURE N° FA{invoice_number}"
-        for cell in ws["1:1"]:
-            cell.font = Font(name='Calibri', size=26, bold=True)
-            cell.alignment = Alignment(horizontal="center")
-            cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-
-        # Add seller info
-        ws.merge_cells('A3:D3')
-        cell = ws['A3']
-        cell.value = "ELLIETECH PARIS 2014"
-        cell.font = Font(name='Calibri', bold=True)
-        ws.merge_cells('A4:D4')
-        cell = ws['A4']
-        cell.value = "90 Rue de la Haie Coq Bâtiment 243,93300,Aubervilliers"
-        cell.alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        ws.row_dimensions[4].height = 45
-        ws.merge_cells('A5:D5')
-        cell = ws['A5']
-        cell.value = "N° SIRET: 98741912400019"
-        ws.merge_cells('A6:D6')
-        cell = ws['A6']
-        cell.value = "N° TVA: FR 89 987419124"
-        ws.merge_cells('A7:D7')
-        cell = ws['A7']
-        cell.value = "Contact: 07 54 12 06 47"
-
-        # Add client info
-        ws.merge_cells('F3:I3')
-        cell = ws['F3']
-        cell.value = f"Client : {self.client_info['Nom de l\'entreprise'].upper()}"
-        cell.font = Font(name='Calibri', bold=True)
-
-        ws.merge_cells('F4:I4')
-        cell = ws['F4']
-        cell.value = self.client_info["Adresse"]
-        cell.alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        ws.row_dimensions[4].height = 45
-
-        # Check if Num_TVA is filled
-        if "Num_TVA" in self.client_info and self.client_info["Num_TVA"]:
-
-            ws.merge_cells('F5:I5')
-            cell = ws['F5']
-            cell.value = f"N° TVA : {self.client_info['Num_TVA']}"
-
-            ws.merge_cells('F6:I6')
-            cell = ws['F6']
-            cell.value = f"Tel : {self.client_info['Contact']}"
-        else:
-            ws.merge_cells('F5:I5')
-            cell = ws['F5']
-            cell.value = f"Tel : {self.client_info['Contact']}"
-
-        # Add style to the client info
-        thick_border = Border(left=Side(style='thick'), right=Side(style='thick'), top=Side(style='thick'),
-                              bottom=Side(style='thick'))
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'),
-                             bottom=Side(style='thin'))
-
-        ws['F3'].border = Border(top=thick_border.top, left=thick_border.left)
-        ws['I3'].border = Border(top=thick_border.top, right=thick_border.right)
-
-        # Check if Num_TVA is filled
-        if "Num_TVA" in self.client_info and self.client_info["Num_TVA"]:
-            ws['F6'].border = Border(bottom=thick_border.bottom, left=thick_border.left)
-            ws['I6'].border = Border(bottom=thick_border.bottom, right=thick_border.right)
-        else:
-            ws['F5'].border = Border(bottom=thick_border.bottom, left=thick_border.left)
-            ws['I5'].border = Border(bottom=thick_border.bottom, right=thick_border.right)
-
-        # Add time info
-        current_date = datetime.today().strftime('%d/%m/%Y')
-        ws.merge_cells('A10:F10')
-        cell = ws['A10']
-        cell.value = f"Date de facturation: {current_date}"
-        cell.font = Font(name='Calibri', bold=True)
-        cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        ws.merge_cells('A11:F11')
-        cell = ws['A11']
-        cell.value = f"Date de livraison: {current_date}"
-        cell.font = Font(name='Calibri', bold=True)
-        cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        ws.merge_cells('A12:F12')
-        cell = ws['A12']
-        cell.value = f"Mode de paiement: {payment_method}"
-        cell.font = Font(name='Calibri', bold=True)
-        cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-
-        # Add product info
-        ws.append([])  # Empty row
-        ws['A15'] = "Quantité"
-        ws['A15'].alignment = Alignment(horizontal="center")
-        ws['A15'].fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        ws.merge_cells('B15:E15')
-        ws['B15'] = "Nom du produit"
-        ws['B15'].alignment = Alignment(horizontal="center")
-        ws['B15'].fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        ws.merge_cells('F15:G15')
-        ws['F15'] = "Prix unitaire HT"
-        ws['F15'].alignment = Alignment(horizontal="center")
-        ws['F15'].fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        ws.merge_cells('H15:I15')
-        ws['H15'] = "Prix total HT"
-        ws['H15'].alignment = Alignment(horizontal="center")
-        ws['H15'].fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-
-        total_price = 0
-        row = 16
-        for product in self.products:
-            ws[f'A{row}'] = product["Quantité"]
-            ws[f'A{row}'].alignment = Alignment(horizontal="center")
-            ws[f'A{row}'].border = Border(left=thin_border.left, right=thin_border.right, bottom=thin_border.bottom)
-
-            ws.merge_cells(f'B{row}:E{row}')
-            ws[f'B{row}'] = product["Nom du produit"]
-            ws[f'B{row}'].alignment = Alignment(horizontal="center")
-            ws[f'B{row}'].border = Border(left=thin_border.left, bottom=thin_border.bottom)
-            ws[f'C{row}'].border = Border( bottom=thin_border.bottom)
-            ws[f'D{row}'].border = Border(bottom=thin_border.bottom)
-            ws[f'E{row}'].border = Border(right=thin_border.right, bottom=thin_border.bottom)
-
-            ws.merge_cells(f'F{row}:G{row}')
-            ws[f'F{row}'] = product["Prix unitaire"]
-            ws[f'F{row}'].alignment = Alignment(horizontal="center")
-            ws[f'F{row}'].number_format = '#,##0.00 €'
-            ws[f'F{row}'].border = Border(left=thin_border.left, bottom=thin_border.bottom)
-            ws[f'G{row}'].border = Border(right=thin_border.right, bottom=thin_border.bottom)
-
-            ws.merge_cells(f'H{row}:I{row}')
-            ws[f'H{row}'] = product["Prix total"]
-            ws[f'H{row}'].alignment = Alignment(horizontal="center")
-            ws[f'H{row}'].number_format = '#,##0.00 €'
-            ws[f'H{row}'].border = Border(left=thin_border.left, bottom=thin_border.bottom)
-            ws[f'I{row}'].border = Border(right=thin_border.right, bottom=thin_border.bottom)
-
-            total_price += product["Prix total"]
-            row += 1
-
-        ws.merge_cells(f'F{row + 1}:G{row + 1}')
-        ws[f'F{row + 1}'].value = "Total HT"
-        ws.merge_cells(f'H{row + 1}:I{row + 1}')
-        ws[f'H{row + 1}'].value = f"{total_price:.2f} €"
-        ws[f'H{row + 1}'].number_format = '#,##0.00 €'
-        # Check if Num_TVA is filled
-        if "Num_TVA" in self.client_info and self.client_info["Num_TVA"]:
-            # Set TVA 20% to 0
-            ws.merge_cells(f'F{row + 2}:G{row + 2}')
-            ws[f'F{row + 2}'].value = "TVA 20%"
-            ws.merge_cells(f'H{row + 2}:I{row + 2}')
-            ws[f'H{row + 2}'].value = "0.00 €"
-            ws[f'H{row + 2}'].number_format = '#,##0.00 €'
-
-            # Add the phrase about TVA communo code
-            ws.merge_cells(f'A{row + 5}:I{row + 5}')
-            ws[f'A{row + 5}'].value = "Exonération de TVA, article 262 ter 1 du CGI ». vente intracommunautaire"
-
-            # Push the payment phrase to row + 6
-            ws.merge_cells(f'A{row + 6}:I{row + 6}')
-            ws[
-                f'A{row + 6}'].value = f"Facture payée le {current_date} pour la somme de {total_price:.2f} € par {payment_method}"
-        else:
-            # Normal behavior for TVA and Total TTC
-            ws.merge_cells(f'F{row + 2}:G{row + 2}')
-            ws[f'F{row + 2}'].value = "TVA 20%"
-            ws.merge_cells(f'H{row + 2}:I{row + 2}')
-            ws[f'H{row + 2}'].value = f"{total_price * 0.2:.2f} €"
-            ws[f'H{row + 2}'].number_format = '#,##0.00 €'
-
-            ws.merge_cells(f'F{row + 3}:G{row + 3}')
-            ws[f'F{row + 3}'].value = "Total TTC"
-            ws.merge_cells(f'H{row + 3}:I{row + 3}')
-            ws[f'H{row + 3}'].value = f"{total_price + total_price * 0.2:.2f} €"
-            ws[f'H{row + 3}'].number_format = '#,##0.00 €'
-
-            # Add the payment phrase in row + 5
-            ws.merge_cells(f'A{row + 5}:I{row + 5}')
-            ws[
-                f'A{row + 5}'].value = f"Facture payée le {current_date} pour la somme de {total_price + total_price * 0.2:.2f} € par {payment_method}"
-
-        ws.page_setup.orientation = ws.ORIENTATION_PORTRAIT
-        ws.page_setup.paperSize = ws.PAPERSIZE_A4
-        ws.page_margins.left = 0.5
-        ws.page_margins.right = 0.5
-        ws.page_margins.top = 1
-        ws.page_margins.bottom = 1
-        ws.print_options.horizontalCentered = True
-
-        # Set font to Calibri for all cells except cell A1
-        for row in ws.iter_rows():
-            for cell in row:
-                if cell.coordinate != 'A1':
-                    cell.font = Font(name='Calibri')
-
-        excel_file = f"FACTURE {invoice_number}.xlsx"
+        }
+        saved_client = self.save_client_if_not_exists(client)
+
+        # Taken before the file is written: another instance may have issued the previewed number
+        invoice_number = self.invoice_numbers.reserve()
+        self.invoice_number = self.client_info["Numéro de facture"] = invoice_number
+        # Same date on the invoice and in the ledger, even around midnight
+        invoice_date = datetime.today()
+        wb = render_invoice(client, self.products, payment_method, invoice_number, invoice_date)
+
+        excel_file = invoice_file_name(invoice_number)
         wb.save(excel_file)
+        totals = compute_totals(self.products, has_tva_number(client))
+        self.ledger.record(invoice_number, invoice_date, saved_client["id"], client, self.products, payment_method,
+                           totals, excel_file)
+        if self.database is not None:
+            self.database.record_invoice(invoice_number, invoice_date, saved_client["id"], payment_method, totals,
+                                         excel_file)
 
-        # Delete the last generated file if it exists
-        previous_invoice_number = invoice_number - 1
-        previous_excel_file = f"FACTURE {previous_invoice_number}.xlsx"
-        if os.path.exists(previous_excel_file):
-            os.remove(previous_excel_file)
+        self.output_manager.issued()
 
         QMessageBox.information(self, "成功", "发票已生成.")
 
         # Open the Excel file automatically
         os.startfile(excel_file)
 
-        # Increment and save the new invoice number
-        self.invoice_number += 1
-        self.save_invoice_number()
-
         self.close()
 
 if __name__ == "__main__":
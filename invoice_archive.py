@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import zipfile
+import zlib
+from invoice_numbers import LOCK_SUFFIX, file_lock
+from invoice_renderer import invoice_file_name
+
+# Monthly zip archives of the issued invoices (archives/FACTURES 2024-06.zip), with a sidecar index.
+#
+# FACTURES 2024-06.zip.idx maps each invoice number to where its member is in the zip: offset of the
+# local header, compression, sizes and CRC. Extracting one invoice is then a seek to that offset and
+# the decompression of that member only, without reading the central directory of the archive.
+# Appending a member does not move the existing ones, so the index only gets new entries. It records
+# the size and date of the zip it describes: an index that does not match its zip (written by an older
+# version, zip copied back from a backup) is rebuilt from the zip's central directory.
+#
+#   python invoice_archive.py 430 [-o .] [--archive-dir archives]    extract FACTURE 430.xlsx
+
+DEFAULT_ARCHIVE_DIR = 'archives'
+INDEX_SUFFIX = ".idx"
+
+# Local file header: signature, versions, flags, compression, time, date, CRC, sizes, name and extra lengths
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+
+
+def archive_name(month):
+    return f"FACTURES {month}.zip"
+
+
+def member_number(name):
+    """Invoice number of a FACTURE N.xlsx member, or None."""
+    if name.startswith("FACTURE ") and name.endswith(".xlsx") and name[8:-5].isdigit():
+        return int(name[8:-5])
+    return None
+
+
+class MonthlyArchive:
+    """Zip of the invoices of one month, with its number -> member index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.lock_path = path + LOCK_SUFFIX
+        self.members = None
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_index(self):
+        """number -> [header offset, compression, compressed size, size, CRC] of the members."""
+        if self.members is None and not self._read_index():
+            with file_lock(self.lock_path):
+                self.rebuild_index()
+        return self.members
+
+    def _read_index(self):
+        """Read the index file. Return False if it is missing or does not match the zip."""
+        if not os.path.exists(self.path):
+            self.members = {}
+            return True
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if index.get("zip") != self._stat():
+            return False
+        self.members = {int(number): member for number, member in index["members"].items()}
+        return True
+
+    def rebuild_index(self):
+        """Index every member from the central directory of the zip. Called under the archive lock."""
+        self.members = {}
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                number = member_number(info.filename)
+                if number is not None:
+                    self.members[number] = self._member(info)
+        self.write_index()
+
+    @staticmethod
+    def _member(info):
+        return [info.header_offset, info.compress_type, info.compress_size, info.file_size, info.CRC]
+
+    def write_index(self):
+        index = {"zip": self._stat(), "members": {str(number): member for number, member in self.members.items()}}
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(temp_path, self.index_path)
+
+    def __contains__(self, number):
+        return number in self.load_index()
+
+    def add(self, number, path):
+        """Move the invoice file path into the archive."""
+        self.add_many([(number, path)])
+
+    def add_many(self, files):
+        """Move (number, path) invoice files into the archive, opening the zip once.
+
+        Each reopening of the zip rewrites its central directory: adding the files one by one would
+        cost a rewrite per file.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with file_lock(self.lock_path):
+            # Files archived meanwhile by another instance sharing the directory are gone
+            files = [(number, path) for number, path in files if os.path.exists(path)]
+            if not files:
+                return
+            # Read again under the lock: another instance may have appended since
+            if not self._read_index():
+                self.rebuild_index()
+            # Files already there were left by a run stopped between writing them and deleting the file
+            new_files = [(number, path) for number, path in files if number not in self.members]
+            if new_files:
+                with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+                    for number, path in new_files:
+                        archive.write(path, invoice_file_name(number))
+                        self.members[number] = self._member(archive.getinfo(invoice_file_name(number)))
+                self.write_index()
+            for number, path in files:
+                os.remove(path)
+
+    def read(self, number):
+        """Content of the FACTURE number member, read from its offset. KeyError if it is not archived."""
+        header_offset, compress_type, compress_size, file_size, crc = self.load_index()[number]
+        with open(self.path, 'rb') as file:
+            file.seek(header_offset)
+            header = LOCAL_HEADER.unpack(file.read(LOCAL_HEADER.size))
+            if header[0] != LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"{self.path}: no member at offset {header_offset}")
+            # The name and extra field lengths of the local header may differ from the central directory's
+            file.seek(header[9] + header[10], os.SEEK_CUR)
+            data = file.read(compress_size)
+        if compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif compress_type != zipfile.ZIP_STORED:
+            raise zipfile.BadZipFile(f"{self.path}: unsupported compression {compress_type}")
+        if len(data) != file_size or zlib.crc32(data) != crc:
+            raise zipfile.BadZipFile(f"{self.path}: FACTURE {number} is corrupted")
+        return data
+
+    def extract(self, number, output_dir=''):
+        """Write FACTURE number.xlsx to output_dir and return its path."""
+        data = self.read(number)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        excel_file = os.path.join(output_dir, invoice_file_name(number))
+        temp_path = f"{excel_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, excel_file)
+        return excel_file
+
+
+def find_archive(number, archive_dir=DEFAULT_ARCHIVE_DIR, month=None):
+    """MonthlyArchive holding FACTURE number, or None.
+
+    With the month of the invoice ('YYYY-MM', from the ledger) only that archive is looked at.
+    """
+    if month is not None:
+        names = [archive_name(month)]
+    else:
+        try:
+            names = sorted((name for name in os.listdir(archive_dir) if name.endswith(".zip")), reverse=True)
+        except FileNotFoundError:
+            return None
+    for name in names:
+        archive = MonthlyArchive(os.path.join(archive_dir, name))
+        if number in archive:
+            return archive
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract archived invoices from the monthly invoice archives.")
+    parser.add_argument("numbers", nargs="+", type=int, help="invoice numbers")
+    parser.add_argument("-o", "--output-dir", default="", help="directory for the extracted files")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="directory of the monthly invoice archives")
+    parser.add_argument("--month", help="month of the invoices (YYYY-MM), to look in that archive only")
+    args = parser.parse_args(argv)
+
+    try:
+        for number in args.numbers:
+            archive = find_archive(number, args.archive_dir, args.month)
+            if archive is None:
+                raise ValueError(f"invoice {number} is not archived")
+            print(archive.extract(number, args.output_dir))
+    except (ValueError, OSError, zipfile.BadZipFile) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.exceptions import IllegalCharacterError
+from client_store import CLIENT_FIELDS, ClientStore
+from invoice_db import InvoiceDatabase
+from invoice_ledger import DEFAULT_LEDGER, InvoiceLedger, ledger_entry
+from invoice_money import compute_totals, line_total, to_decimal
+from invoice_numbers import InvoiceNumberAllocator
+from invoice_output import DEFAULT_ARCHIVE_DIR, RETENTION_POLICIES, InvoiceOutputManager
+from invoice_renderer import render_invoice, invoice_file_name, has_tva_number, PAYMENT_METHODS
+from invoice_streaming import write_invoice_streaming, STREAMING_THRESHOLD
+from invoice_template import load_template
+
+# Batch mode: generate one FACTURE N.xlsx per order of an orders file without going through the GUI.
+#
+# JSON orders file:
+#   [{"client": "iti informatique", "payment": "CB",
+#     "products": [{"Nom du produit": "GRS12", "Quantité": 12, "Prix unitaire": 12.0}]}]
+#
+# CSV orders file (one line per product, lines with the same "order" value form one invoice;
+# without an "order" column consecutive lines with the same client and payment are grouped):
+#   order,client,payment,product,quantity,price
+#   1,iti informatique,CB,GRS12,12,12.0
+
+
+#--------------------------------------------------orders--------------------------------------------------
+def to_quantity(quantity):
+    """Quantity of a product line: a positive whole number, given as a JSON int or a digit string (as in the GUI).
+
+    Raise ValueError otherwise, rather than invoicing 2.7 as 2.
+    """
+    if isinstance(quantity, str) and quantity.strip().isdigit():
+        quantity = int(quantity)
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+        raise ValueError(f"invalid quantity '{quantity}'")
+    return quantity
+
+
+def make_product(name, quantity, price):
+    quantity = to_quantity(quantity)
+    price = to_decimal(price)
+    return {
+        "Nom du produit": name,
+        "Quantité": quantity,
+        "Prix unitaire": price,
+        "Prix total": line_total(quantity, price)
+    }
+
+
+def read_orders(path):
+    """Read a .json or .csv orders file into a list of {"client", "payment", "products"} dicts."""
+    if path.lower().endswith('.csv'):
+        return read_csv_orders(path)
+    with open(path, 'r', encoding='utf-8') as file:
+        orders = json.load(file)
+    for order in orders:
+        order["products"] = [
+            make_product(p["Nom du produit"], p["Quantité"], p["Prix unitaire"]) for p in order.get("products", [])
+        ]
+    return orders
+
+
+def read_csv_orders(path):
+    orders = []
+    current_key = None
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        for line in csv.DictReader(file):
+            key = line.get("order") or (line["client"], line["payment"])
+            if key != current_key:
+                orders.append({"client": line["client"], "payment": line["payment"], "products": []})
+                current_key = key
+            orders[-1]["products"].append(make_product(line["product"], line["quantity"], line["price"]))
+    return orders
+
+
+def resolve_orders(orders, clients):
+    """Attach the saved client record to each order.
+
+    Raise ValueError on unknown clients or payments, and on text that cannot be written to a cell.
+
+    clients is a ClientStore.
+    """
+    for index, order in enumerate(orders, start=1):
+        client = clients.find(order["client"])
+        if client is None:
+            raise ValueError(f"order {index}: unknown client '{order['client']}'")
+        if order["payment"] not in PAYMENT_METHODS:
+            raise ValueError(f"order {index}: unknown payment method '{order['payment']}'")
+        if not order["products"]:
+            raise ValueError(f"order {index}: no products")
+        # Control characters cannot be written to a cell: found here, before any number is reserved,
+        # rather than by openpyxl halfway through the batch
+        texts = [client.get(key, "") for key in CLIENT_FIELDS]
+        texts += [product["Nom du produit"] for product in order["products"]]
+        for text in texts:
+            if ILLEGAL_CHARACTERS_RE.search(str(text)):
+                raise ValueError(f"order {index}: control character in {text!r}")
+        order["client_record"] = client
+    return orders
+
+
+#--------------------------------------------------batch generation--------------------------------------------------
+class UnissuedNumbersError(Exception):
+    """A rendering failed after the batch numbers were reserved: numbers holds those left unissued."""
+
+    def __init__(self, error, numbers):
+        super().__init__(f"{error} (invoice numbers reserved but not issued: {number_ranges(numbers)})")
+        self.numbers = numbers
+
+
+def number_ranges(numbers):
+    """'1503-1504, 1507' for [1503, 1504, 1507]."""
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def render_job(job):
+    """Render one invoice to its file. Top level so it can run in a worker process."""
+    client, products, payment_method, invoice_number, invoice_date, excel_file, template, formulas = job
+    temp_path = f"{excel_file}.{os.getpid()}.tmp"
+    try:
+        if template:
+            load_template(template).stamp(client, products, payment_method, invoice_number, invoice_date,
+                                          formulas).save(temp_path)
+        elif len(products) >= STREAMING_THRESHOLD:
+            write_invoice_streaming(client, products, payment_method, invoice_number, temp_path, invoice_date,
+                                    formulas)
+        else:
+            render_invoice(client, products, payment_method, invoice_number, invoice_date, formulas).save(temp_path)
+        # Rename once complete, so a FACTURE file is never half written
+        os.replace(temp_path, excel_file)
+    except BaseException:
+        # No stray temp file when rendering or the rename fails
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return excel_file
+
+
+def generate_batch(orders_path, output_dir='', clients_path='clients.json',
+                   invoice_number_path='invoiceNumber.json', jobs=1, template=None, formulas=False,
+                   database_path=None, ledger_path=DEFAULT_LEDGER, retention="keep_all", keep_last=1,
+                   archive_dir=DEFAULT_ARCHIVE_DIR):
+    """Generate one invoice per order and return the list of written files.
+
+    The invoice numbers of the whole batch are reserved before rendering starts, so with jobs > 1 the
+    orders can be rendered in any process while the numbers stay sequential and follow the orders file.
+    Every order is checked first (clients, payments, quantities, prices, text), so that a number is only
+    reserved for an invoice that can be rendered. If a rendering still fails, UnissuedNumbersError
+    gives the reserved numbers left without an invoice.
+    With a template path, invoices are stamped from that FACTURE workbook (see invoice_template.py).
+    With formulas, the totals are SUM formulas over the line totals instead of numbers.
+    With a database path, clients and invoice numbers come from that SQLite database (see invoice_db.py)
+    instead of the JSON files, and the generated invoices are recorded in it.
+    Each invoice is appended to the ledger at ledger_path (see invoice_ledger.py) as soon as its file is
+    written, then the retention policy is applied to the output directory (see invoice_output.py).
+    Invoices with STREAMING_THRESHOLD products or more are streamed (see invoice_streaming.py).
+    """
+    database = InvoiceDatabase(database_path) if database_path else None
+    try:
+        clients = database.clients if database else ClientStore(clients_path)
+        orders = resolve_orders(read_orders(orders_path), clients)
+        if template:
+            # Fail before reserving numbers if the template is unreadable
+            load_template(template)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        # One reservation for the whole batch, safe against GUI instances or other runs taking numbers meanwhile
+        invoice_numbers = database.invoice_numbers if database else InvoiceNumberAllocator(invoice_number_path)
+        first_number = invoice_numbers.reserve(len(orders))
+        invoice_date = datetime.today()
+        ledger = InvoiceLedger(ledger_path)
+        invoices = []
+        try:
+            for invoice_number, order, excel_file in render_orders(orders, first_number, invoice_date, output_dir,
+                                                                   jobs, template, formulas):
+                totals = compute_totals(order["products"], has_tva_number(order["client_record"]))
+                # Recorded as soon as the file is written: if a later order fails, every invoice
+                # file left in the output directory is in the ledger
+                ledger.append([ledger_entry(invoice_number, invoice_date, order["client_record"]["id"],
+                                            order["client_record"], order["products"], order["payment"], totals,
+                                            excel_file)])
+                invoices.append((invoice_number, order, totals, excel_file))
+        except Exception as error:
+            issued = {invoice[0] for invoice in invoices}
+            unissued = [number for number in range(first_number, first_number + len(orders)) if number not in issued]
+            raise UnissuedNumbersError(error, unissued) from error
+        finally:
+            if database and invoices:
+                database.record_invoices([
+                    (invoice_number, invoice_date, order["client_record"]["id"], order["payment"], totals,
+                     excel_file)
+                    for invoice_number, order, totals, excel_file in invoices
+                ])
+    finally:
+        if database:
+            database.close()
+    InvoiceOutputManager(output_dir, retention, keep_last, archive_dir, ledger_path).apply_retention()
+    invoices.sort(key=lambda invoice: invoice[0])
+    return [excel_file for invoice_number, order, totals, excel_file in invoices]
+
+
+def render_orders(orders, first_number, invoice_date, output_dir='', jobs=1, template=None, formulas=False):
+    """Render the orders to invoices numbered from first_number.
+
+    Yield (invoice number, order, written file) as each invoice is written, in any order with jobs > 1.
+    Once a rendering fails no other order is started: the invoices written meanwhile are still yielded,
+    then the error is raised.
+    """
+    render_jobs = []
+    for invoice_number, order in enumerate(orders, start=first_number):
+        excel_file = os.path.join(output_dir, invoice_file_name(invoice_number))
+        render_jobs.append((invoice_number, order, (order["client_record"], order["products"], order["payment"],
+                                                    invoice_number, invoice_date, excel_file, template, formulas)))
+
+    if jobs == 1 or len(render_jobs) < 2:
+        for invoice_number, order, job in render_jobs:
+            yield invoice_number, order, render_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # One task per invoice rather than chunks, so each invoice is reported as soon as it is written
+        futures = {executor.submit(render_job, job): (invoice_number, order)
+                   for invoice_number, order, job in render_jobs}
+        error = None
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                if error is None:
+                    error = future.exception()
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            invoice_number, order = futures[future]
+            yield invoice_number, order, future.result()
+        if error is not None:
+            raise error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate invoices from an orders file (.json or .csv).")
+    parser.add_argument("orders", help="orders file")
+    parser.add_argument("-o", "--output-dir", default="", help="directory for the FACTURE N.xlsx files")
+    parser.add_argument("--clients", default="clients.json", help="saved clients file")
+    parser.add_argument("--invoice-number", default="invoiceNumber.json", help="invoice number file")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of rendering processes (0 = one per CPU core)")
+    parser.add_argument("--template", help="FACTURE workbook to stamp invoices from (e.g. \"FACTURE 25.xlsx\")")
+    parser.add_argument("--database", help="SQLite database to use instead of the JSON files (see invoice_db.py)")
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER, help="ledger the generated invoices are appended to")
+    parser.add_argument("--retention", choices=RETENTION_POLICIES, default="keep_all",
+                        help="what to do with the older invoice files of the output directory")
+    parser.add_argument("--keep-last", type=int, default=1,
+                        help="number of invoice files kept in the output directory by keep_last and archive")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="directory of the monthly invoice archives")
+    parser.add_argument("--formulas", action="store_true",
+                        help="write the totals as formulas over the line totals instead of numbers")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        files = generate_batch(args.orders, args.output_dir, args.clients, args.invoice_number,
+                               args.jobs or os.cpu_count(), args.template, args.formulas, args.database,
+                               args.ledger, args.retention, args.keep_last, args.archive_dir)
+    except (ValueError, KeyError, OSError, sqlite3.Error, IllegalCharacterError, UnissuedNumbersError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"{len(files)} invoices generated in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+import argparse
+import sqlite3
+import sys
+from contextlib import contextmanager
+from client_store import CLIENT_FIELDS, ClientStore, ID_KEY, NAME_KEY, normalize_name
+from invoice_numbers import InvoiceNumberAllocator
+
+# Optional SQLite storage for the saved clients, the invoice counter and the issued invoices.
+#
+# The JSON files are rewritten whole on every change; here each change is one indexed row write.
+# The database is used instead of clients.json / invoiceNumber.json once it exists, i.e. after a
+# one-shot import of the JSON files:
+#   python invoice_db.py factures.db --clients clients.json --invoice-number invoiceNumber.json
+
+DEFAULT_DATABASE = "factures.db"
+
+# Column of each client record key
+CLIENT_COLUMNS = {
+    "Nom de l'entreprise": "name",
+    "Adresse": "address",
+    "Adresse_cp": "postcode",
+    "Adresse_ville": "city",
+    "Contact": "contact",
+    "Num_TVA": "tva_number",
+}
+
+# AUTOINCREMENT: the id of a deleted client is never given to a new one, even the highest id
+CLIENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS clients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL DEFAULT '',
+    postcode TEXT NOT NULL DEFAULT '',
+    city TEXT NOT NULL DEFAULT '',
+    contact TEXT NOT NULL DEFAULT '',
+    tva_number TEXT NOT NULL DEFAULT ''
+);
+"""
+CLIENTS_INDEX = "CREATE INDEX IF NOT EXISTS clients_name_key ON clients (name_key);"
+
+SCHEMA = CLIENTS_TABLE + CLIENTS_INDEX + """
+
+CREATE TABLE IF NOT EXISTS invoices (
+    number INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    client_id INTEGER,
+    payment_method TEXT NOT NULL,
+    total_ht TEXT NOT NULL,
+    tva TEXT NOT NULL,
+    total_ttc TEXT NOT NULL,
+    file TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoices_client ON invoices (client_id);
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def connect(path=DEFAULT_DATABASE):
+    # Autocommit: single statements commit on their own, multi-statement changes use transaction()
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    # WAL lets the GUI read while a batch run writes, and makes each commit an append to the log
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA busy_timeout=5000")
+    connection.executescript(SCHEMA)
+    upgrade_clients_table(connection)
+    return connection
+
+
+def clients_table_sql(connection):
+    return connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'clients'").fetchone()[0]
+
+
+def upgrade_clients_table(connection):
+    """Rebuild a clients table created without AUTOINCREMENT (older versions), keeping the ids."""
+    if "AUTOINCREMENT" in clients_table_sql(connection):
+        return
+    with transaction(connection):
+        # Another process may have upgraded it meanwhile
+        if "AUTOINCREMENT" in clients_table_sql(connection):
+            return
+        connection.execute("ALTER TABLE clients RENAME TO clients_old")
+        connection.execute(CLIENTS_TABLE)
+        connection.execute("INSERT INTO clients SELECT * FROM clients_old")
+        connection.execute("DROP TABLE clients_old")
+        connection.execute(CLIENTS_INDEX)
+
+
+@contextmanager
+def transaction(connection):
+    """Run the block in a write transaction, taking the database write lock up front."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def client_row(client):
+    values = {column: client.get(key, "") for key, column in CLIENT_COLUMNS.items()}
+    values["name_key"] = normalize_name(values["name"])
+    return values
+
+
+def client_record(row):
+    record = {key: row[column] for key, column in CLIENT_COLUMNS.items()}
+    record[ID_KEY] = row["id"]
+    return record
+
+
+class InvoiceDatabase:
+    """Clients, invoice counter and issued invoices of the SQLite storage."""
+
+    def __init__(self, path=DEFAULT_DATABASE):
+        self.path = path
+        self.connection = connect(path)
+        self.clients = SQLiteClientStore(self.connection)
+        self.invoice_numbers = SQLiteInvoiceNumberAllocator(self)
+
+    def close(self):
+        self.connection.close()
+
+    #---invoice counter---
+    def load_invoice_number(self):
+        row = self.connection.execute("SELECT value FROM counters WHERE name = 'invoice_number'").fetchone()
+        return 1 if row is None else row["value"]
+
+    def save_invoice_number(self, invoice_number):
+        self.connection.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('invoice_number', ?)",
+                                (invoice_number,))
+
+    def reserve_invoice_numbers(self, count=1):
+        """Take the next count invoice numbers in one transaction and return the first one."""
+        with transaction(self.connection):
+            first_number = self.load_invoice_number()
+            self.save_invoice_number(first_number + count)
+        return first_number
+
+    #---issued invoices---
+    def record_invoices(self, invoices):
+        """Record issued invoices: (number, date, client_id, payment_method, totals, file) tuples."""
+        with transaction(self.connection):
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO invoices (number, date, client_id, payment_method, total_ht, tva, "
+                "total_ttc, file) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(number, invoice_date.strftime('%Y-%m-%d'), client_id, payment_method, str(totals.ht),
+                  str(totals.tva), str(totals.ttc), file)
+                 for number, invoice_date, client_id, payment_method, totals, file in invoices]
+            )
+
+    def record_invoice(self, number, invoice_date, client_id, payment_method, totals, file):
+        self.record_invoices([(number, invoice_date, client_id, payment_method, totals, file)])
+
+    def client_invoices(self, client_id):
+        return self.connection.execute("SELECT * FROM invoices WHERE client_id = ? ORDER BY number",
+                                       (client_id,)).fetchall()
+
+
+class SQLiteInvoiceNumberAllocator:
+    """InvoiceNumberAllocator interface over the counters table: the write transaction is the lock."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def peek(self):
+        return self.database.load_invoice_number()
+
+    def reserve(self, count=1):
+        return self.database.reserve_invoice_numbers(count)
+
+
+class SQLiteClientStore:
+    """ClientStore interface over the clients table. Every change is written at once, save() does nothing."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    def __iter__(self):
+        return (client_record(row) for row in self.connection.execute("SELECT * FROM clients ORDER BY id"))
+
+    def ids(self):
+        return [row[0] for row in self.connection.execute("SELECT id FROM clients ORDER BY id")]
+
+    def summaries(self):
+        # Rows are small: the full records serve as summaries
+        return iter(self)
+
+    def summary(self, client_id):
+        return self.get(client_id)
+
+    def get(self, client_id):
+        row = self.connection.execute("SELECT * FROM clients WHERE id = ?", (client_id,)).fetchone()
+        return None if row is None else client_record(row)
+
+    def find(self, name):
+        row = self.connection.execute("SELECT * FROM clients WHERE name_key = ? ORDER BY id DESC LIMIT 1",
+                                      (normalize_name(name),)).fetchone()
+        return None if row is None else client_record(row)
+
+    def add(self, client):
+        values = client_row(client)
+        cursor = self.connection.execute(
+            f"INSERT INTO clients ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            list(values.values())
+        )
+        return self.get(cursor.lastrowid)
+
+    def update(self, client_id, client):
+        record = self.get(client_id)
+        if record is None:
+            # Deleted meanwhile by another instance, as ClientStore.update
+            raise KeyError(client_id)
+        values = client_row(record | {key: client[key] for key in CLIENT_FIELDS if key in client})
+        self.connection.execute(f"UPDATE clients SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                                list(values.values()) + [client_id])
+        return self.get(client_id)
+
+    def delete(self, client_id):
+        record = self.get(client_id)
+        self.connection.execute("DELETE FROM clients WHERE id = ?", (client_id,))
+        return record
+
+    def upsert(self, client):
+        record = self.find(client[NAME_KEY])
+        if record is None:
+            return self.add(client)
+        return self.update(record[ID_KEY], client)
+
+    def save(self):
+        pass
+
+
+#--------------------------------------------------JSON import--------------------------------------------------
+def reserve_client_ids(connection, last_id):
+    """Make the clients table give ids above last_id only."""
+    if connection.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'clients'", (last_id,)).rowcount == 0:
+        connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('clients', ?)", (last_id,))
+
+
+def import_json(database, clients_path='clients.json', invoice_number_path='invoiceNumber.json'):
+    """Copy the JSON clients (keeping their ids) and invoice counter into the database, in one transaction."""
+    clients = ClientStore(clients_path)
+    invoice_number = InvoiceNumberAllocator(invoice_number_path).peek()
+
+    with transaction(database.connection):
+        rows = []
+        for client in clients:
+            values = client_row(client)
+            values["id"] = client[ID_KEY]
+            rows.append(values)
+        if rows:
+            database.connection.executemany(
+                f"INSERT OR REPLACE INTO clients ({', '.join(rows[0])}) VALUES ({', '.join('?' * len(rows[0]))})",
+                [list(values.values()) for values in rows]
+            )
+        # Ids of clients deleted from the JSON store are not given again either
+        reserve_client_ids(database.connection, clients.next_id - 1)
+        # Never go back to numbers the database has already issued
+        database.save_invoice_number(max(invoice_number, database.load_invoice_number()))
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import clients.json and invoiceNumber.json into a SQLite database.")
+    parser.add_argument("database", nargs="?", default=DEFAULT_DATABASE, help="database file")
+    parser.add_argument("--clients", default="clients.json", help="saved clients file")
+    parser.add_argument("--invoice-number", default="invoiceNumber.json", help="invoice number file")
+    args = parser.parse_args(argv)
+
+    database = InvoiceDatabase(args.database)
+    try:
+        count = import_json(database, args.clients, args.invoice_number)
+    finally:
+        database.close()
+    print(f"{count} clients imported into {args.database}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
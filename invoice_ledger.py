@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from client_store import CLIENT_FIELDS
+from invoice_money import to_decimal
+from invoice_numbers import LOCK_SUFFIX, file_lock
+
+# Append-only ledger of the issued invoices.
+#
+# factures.jsonl gets one JSON line per invoice as it is written: number, date, client id, payment
+# method, HT/TVA/TTC, the file and the SHA-256 of its content, plus the client fields and products it
+# was rendered from, so an invoice can be looked up or rendered again without opening its workbook.
+# Lines are only ever appended, under the same kind of lock as invoiceNumber.json.
+#
+# The ledger is read when first queried: its lines are indexed by number, client and date (byte
+# offsets only), and an entry is read back from its offset when asked for. Each query first indexes
+# the lines appended since, by this process or another one.
+
+DEFAULT_LEDGER = 'factures.jsonl'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ledger_entry(number, invoice_date, client_id, client, products, payment_method, totals, file):
+    """Ledger line of an invoice whose file has just been written."""
+    return {
+        "number": number,
+        "date": invoice_date.strftime('%Y-%m-%d'),
+        "client_id": client_id,
+        "payment_method": payment_method,
+        "total_ht": str(totals.ht),
+        "tva": str(totals.tva),
+        "total_ttc": str(totals.ttc),
+        "file": file,
+        "sha256": file_sha256(file),
+        "client": {key: client.get(key, "") for key in CLIENT_FIELDS},
+        # Prices as decimal strings: what was rendered, without float rounding
+        "products": [{"Nom du produit": product["Nom du produit"], "Quantité": product["Quantité"],
+                      "Prix unitaire": str(to_decimal(product["Prix unitaire"]))} for product in products],
+    }
+
+
+class InvoiceLedger:
+    """Issued invoices of a ledger file, indexed by number, client id and date."""
+
+    def __init__(self, path=DEFAULT_LEDGER):
+        self.path = path
+        self.lock_path = path + LOCK_SUFFIX
+        # number -> (offset, length, client id, date) of the last line of that number
+        self.lines = {}
+        self.client_numbers = defaultdict(set)
+        # Sorted (date, number) pairs
+        self.dates = []
+        # Bytes of the file already indexed
+        self.size = 0
+
+    #---appends---
+    def append(self, entries):
+        """Append ledger lines (ledger_entry dicts) in one write."""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode('utf-8')
+        with file_lock(self.lock_path):
+            with open(self.path, 'a+b') as file:
+                file.seek(0, 2)
+                if file.tell():
+                    file.seek(-1, 2)
+                    if file.read(1) != b"\n":
+                        # Line cut short by a crash: ended so that it stays one unreadable line
+                        data = b"\n" + data
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def record(self, number, invoice_date, client_id, client, products, payment_method, totals, file):
+        entry = ledger_entry(number, invoice_date, client_id, client, products, payment_method, totals, file)
+        self.append([entry])
+        return entry
+
+    #---index---
+    def refresh(self):
+        """Index the lines appended since the last refresh."""
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            file.seek(self.size)
+            offset = self.size
+            for line in file:
+                if not line.endswith(b"\n"):
+                    # Still being appended by another process: indexed by a later refresh
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if entry is not None:
+                    self._index(entry, offset, len(line))
+                offset += len(line)
+            self.size = offset
+
+    def _index(self, entry, offset, length):
+        number = entry["number"]
+        if number in self.lines:
+            # Recorded again (same number re-issued): the last line wins
+            client_id, date = self.lines[number][2:]
+            self.client_numbers[client_id].discard(number)
+            del self.dates[bisect_left(self.dates, (date, number))]
+        self.lines[number] = (offset, length, entry["client_id"], entry["date"])
+        self.client_numbers[entry["client_id"]].add(number)
+        insort(self.dates, (entry["date"], number))
+
+    def _read(self, file, number):
+        offset, length = self.lines[number][:2]
+        file.seek(offset)
+        return json.loads(file.read(length))
+
+    def _read_all(self, numbers):
+        numbers = list(numbers)
+        if not numbers:
+            return []
+        with open(self.path, 'rb') as file:
+            return [self._read(file, number) for number in numbers]
+
+    #---queries---
+    def __len__(self):
+        self.refresh()
+        return len(self.lines)
+
+    def get(self, number):
+        """Ledger entry of an invoice number, or None."""
+        self.refresh()
+        if number not in self.lines:
+            return None
+        return self._read_all([number])[0]
+
+    def client_invoices(self, client_id):
+        """Ledger entries of a client, by number."""
+        self.refresh()
+        return self._read_all(sorted(self.client_numbers.get(client_id, ())))
+
+    def invoices_between(self, first_date, last_date):
+        """Ledger entries dated first_date..last_date (date objects or 'YYYY-MM-DD', both included), by date."""
+        self.refresh()
+        first_date, last_date = str(first_date), str(last_date)
+        start = bisect_left(self.dates, (first_date,))
+        # Sorts after every (last_date, number) pair
+        end = bisect_right(self.dates, (last_date, float('inf')))
+        return self._read_all(number for date, number in self.dates[start:end])
@@ -0,0 +1,56 @@
+from collections import namedtuple
+from decimal import Decimal, Context, InvalidOperation, ROUND_HALF_UP, localcontext
+
+# Money computations of the invoices, exact to the cent.
+#
+# Amounts are Decimal in a fixed context. Each line total (quantity x unit price) is rounded to the
+# cent, the TVA is computed once on the total HT and rounded to the cent, and TTC = HT + TVA, all
+# rounding half up ("arrondi commercial") as on French invoices.
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+TVA_RATE = Decimal('0.20')
+MONEY_CONTEXT = Context(prec=28, rounding=ROUND_HALF_UP)
+
+InvoiceTotals = namedtuple("InvoiceTotals", ["line_totals", "ht", "tva", "ttc", "tva_exempt"])
+
+
+def to_decimal(value):
+    """Convert a price or a quantity (int, float, str or Decimal) to Decimal.
+
+    Floats go through str() so that 9.99 becomes Decimal('9.99') rather than its binary approximation.
+    Raise ValueError on text that is not a number ("12,5") and on NaN or infinity, which cannot be rounded.
+    """
+    if not isinstance(value, Decimal):
+        try:
+            value = Decimal(str(value) if isinstance(value, float) else value)
+        except InvalidOperation:
+            raise ValueError(f"invalid amount '{value}'") from None
+    if not value.is_finite():
+        raise ValueError(f"invalid amount '{value}'")
+    return value
+
+
+def round_cents(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def line_total(quantity, unit_price):
+    with localcontext(MONEY_CONTEXT):
+        return round_cents(to_decimal(quantity) * to_decimal(unit_price))
+
+
+def compute_totals(products, tva_exempt=False):
+    """Compute the line totals, HT, TVA and TTC of an invoice in one pass over its products.
+
+    tva_exempt is True for clients with a foreign TVA number, who are not charged the French TVA.
+    """
+    with localcontext(MONEY_CONTEXT):
+        line_totals = []
+        ht = ZERO
+        for product in products:
+            total = round_cents(to_decimal(product["Quantité"]) * to_decimal(product["Prix unitaire"]))
+            line_totals.append(total)
+            ht += total
+        tva = ZERO if tva_exempt else round_cents(ht * TVA_RATE)
+        return InvoiceTotals(line_totals, ht, tva, ht + tva, tva_exempt)
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+# Invoice number allocator shared by every process issuing invoices (several GUI instances on a shared
+# folder, batch runs).
+#
+# invoiceNumber.json keeps the next free number, as before. reserve(count) takes count numbers in one
+# step: it holds an exclusive lock on invoiceNumber.json.lock while it reads the file and writes the
+# number after the block, so two processes never get the same number. The new file is written next to
+# the old one and renamed over it, so a crash never leaves it empty or half written.
+
+DEFAULT_INVOICE_NUMBER_FILE = 'invoiceNumber.json'
+LOCK_SUFFIX = ".lock"
+# Seconds to wait for another process to release the lock
+LOCK_TIMEOUT = 10
+LOCK_RETRY_DELAY = 0.05
+
+
+def _try_lock(file):
+    try:
+        if msvcrt is not None:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.lockf(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(file):
+    if msvcrt is not None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.lockf(file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """Hold an exclusive lock on the file path (created if needed) for the block, across processes and PCs."""
+    with open(path, 'a+b') as file:
+        deadline = time.monotonic() + timeout
+        while not _try_lock(file):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{path} is locked by another process")
+            time.sleep(LOCK_RETRY_DELAY)
+        try:
+            yield
+        finally:
+            _unlock(file)
+
+
+def read_invoice_number(path=DEFAULT_INVOICE_NUMBER_FILE):
+    try:
+        with open(path, 'r') as file:
+            content = file.read().strip()
+            if content:
+                return json.loads(content).get('invoice_number', 1)
+    except FileNotFoundError:
+        pass
+    return 1
+
+
+def write_invoice_number(invoice_number, path=DEFAULT_INVOICE_NUMBER_FILE):
+    """Replace the number file in one rename, never leaving a partly written file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump({'invoice_number': invoice_number}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class InvoiceNumberAllocator:
+    """Invoice numbers of an invoiceNumber.json file, taken under its lock."""
+
+    def __init__(self, path=DEFAULT_INVOICE_NUMBER_FILE):
+        self.path = path
+        self.lock_path = path + LOCK_SUFFIX
+
+    def peek(self):
+        """Next free number, without taking it (another process may take it first)."""
+        with file_lock(self.lock_path):
+            return read_invoice_number(self.path)
+
+    def reserve(self, count=1):
+        """Take the next count invoice numbers and return the first one."""
+        with file_lock(self.lock_path):
+            first_number = read_invoice_number(self.path)
+            write_invoice_number(first_number + count, self.path)
+        return first_number
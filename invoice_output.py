@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import re
+import sys
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from invoice_archive import DEFAULT_ARCHIVE_DIR, MonthlyArchive, archive_name
+from invoice_ledger import DEFAULT_LEDGER, InvoiceLedger, file_sha256
+
+# Retention of the generated FACTURE N.xlsx files of an output directory.
+#
+# Only issued invoices are touched: files whose number is in the ledger (invoice_ledger.py) with the
+# SHA-256 of the file. Any other FACTURE N.xlsx (the FACTURE 25.xlsx template, a hand-edited copy)
+# stays where it is and does not count in keep_last.
+#
+# Policies:
+#   keep_all   every file stays in the output directory
+#   keep_last  the keep_last most recent invoices stay, older files are deleted (the ledger can still
+#              reprint them, see invoice_reprint.py)
+#   archive    the keep_last most recent invoices stay, older files are moved into one compressed zip per
+#              month of issue (archives/FACTURES 2024-06.zip, see invoice_archive.py)
+# The GUI applies the policy of settings.json on a background thread after each invoice:
+#   {"retention": {"policy": "archive", "keep_last": 1, "archive_dir": "archives"}}
+# the batch its command line policy once per run. It can also be run on its own, e.g. to archive
+# every issued invoice of a directory:
+#   python invoice_output.py [output_dir] --policy archive --keep-last 0
+
+RETENTION_POLICIES = ["keep_all", "keep_last", "archive"]
+DEFAULT_POLICY = "archive"
+DEFAULT_KEEP_LAST = 1
+SETTINGS_FILE = 'settings.json'
+
+INVOICE_FILE_PATTERN = re.compile(r"FACTURE (\d+)\.xlsx")
+
+
+class InvoiceOutputManager:
+    """Apply a retention policy to the invoice files of an output directory."""
+
+    def __init__(self, output_dir='', policy=DEFAULT_POLICY, keep_last=DEFAULT_KEEP_LAST,
+                 archive_dir=DEFAULT_ARCHIVE_DIR, ledger_path=DEFAULT_LEDGER):
+        if policy not in RETENTION_POLICIES:
+            raise ValueError(f"unknown retention policy '{policy}'")
+        self.output_dir = output_dir
+        self.policy = policy
+        self.keep_last = keep_last
+        self.archive_dir = archive_dir
+        self.ledger = InvoiceLedger(ledger_path)
+        # One worker: archives are written one at a time, in the order the invoices were issued
+        self.executor = None
+
+    @classmethod
+    def from_settings(cls, path=SETTINGS_FILE, output_dir='', ledger_path=DEFAULT_LEDGER):
+        """Manager with the "retention" section of the settings file, the defaults without one.
+
+        Raise ValueError on an unreadable file or invalid values.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                settings = json.load(file).get("retention", {})
+        except FileNotFoundError:
+            settings = {}
+        keep_last = settings.get("keep_last", DEFAULT_KEEP_LAST)
+        if not isinstance(keep_last, int) or keep_last < 0:
+            raise ValueError(f"invalid keep_last '{keep_last}'")
+        return cls(output_dir, settings.get("policy", DEFAULT_POLICY), keep_last,
+                   settings.get("archive_dir", DEFAULT_ARCHIVE_DIR), ledger_path)
+
+    def invoice_files(self):
+        """(number, path) of the FACTURE N.xlsx files of the output directory, by number."""
+        files = []
+        with os.scandir(self.output_dir or '.') as entries:
+            for entry in entries:
+                match = INVOICE_FILE_PATTERN.fullmatch(entry.name)
+                if match and entry.is_file():
+                    files.append((int(match.group(1)), os.path.join(self.output_dir, entry.name)))
+        return sorted(files)
+
+    def issued_files(self):
+        """(number, path, ledger entry) of the invoice files whose number is in the ledger, by number."""
+        files = []
+        for number, path in self.invoice_files():
+            entry = self.ledger.get(number)
+            if entry is not None:
+                files.append((number, path, entry))
+        return files
+
+    def apply_retention(self):
+        """Delete or archive the issued invoices older than the keep_last most recent ones. Return their paths."""
+        if self.policy == "keep_all":
+            return []
+        files = self.issued_files()
+        # A file with the number of an issued invoice but other content is not that invoice: left alone
+        old_files = [(number, path, entry) for number, path, entry in files[:max(len(files) - self.keep_last, 0)]
+                     if file_sha256(path) == entry["sha256"]]
+        if self.policy == "archive":
+            self.archive(old_files)
+        else:
+            for number, path, entry in old_files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Removed meanwhile by another instance sharing the directory
+                    pass
+        return [path for number, path, entry in old_files]
+
+    def archive(self, files):
+        """Move (number, path, ledger entry) invoice files into the zip of their month of issue (see invoice_archive.py)."""
+        months = defaultdict(list)
+        for number, path, entry in files:
+            months[entry["date"][:7]].append((number, path))
+        for month, month_files in sorted(months.items()):
+            MonthlyArchive(os.path.join(self.archive_dir, archive_name(month))).add_many(month_files)
+
+    def issued(self):
+        """Apply the retention policy on the background worker after an invoice was written."""
+        if self.policy == "keep_all":
+            return None
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        future = self.executor.submit(self.apply_retention)
+        future.add_done_callback(self._report_error)
+        return future
+
+    @staticmethod
+    def _report_error(future):
+        if future.exception() is not None:
+            # The invoice itself is written: a failed clean-up is retried after the next invoice
+            print(f"invoice retention failed: {future.exception()}", file=sys.stderr)
+
+    def wait(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a retention policy to the invoice files of a directory.")
+    parser.add_argument("output_dir", nargs="?", default="", help="directory of the FACTURE N.xlsx files")
+    parser.add_argument("--policy", choices=RETENTION_POLICIES, default=DEFAULT_POLICY, help="retention policy")
+    parser.add_argument("--keep-last", type=int, default=DEFAULT_KEEP_LAST,
+                        help="number of invoice files kept in the directory by keep_last and archive")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="directory of the monthly invoice archives")
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER, help="invoice ledger of the issued invoices")
+    args = parser.parse_args(argv)
+
+    manager = InvoiceOutputManager(args.output_dir, args.policy, args.keep_last, args.archive_dir, args.ledger)
+    try:
+        files = manager.apply_retention()
+    except (OSError, zipfile.BadZipFile) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    print(f"{len(files)} invoice files {'archived' if args.policy == 'archive' else 'deleted'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import io
+from copy import copy
+from datetime import datetime
+from openpyxl import Workbook
+from openpyxl.cell import Cell, MergedCell
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from invoice_money import TVA_RATE, compute_totals
+from invoice_styles import StylePalette, apply_style, set_default_font
+
+# Rendering engine for the invoice sheet. Nothing in here depends on Qt, so invoices can be
+# rendered from scripts (batch mode) as well as from the MainWindow of fg_ver_final_1.py.
+
+PAYMENT_METHODS = ["CB", "Virement", "Espèces"]
+
+# Row of the product table column headers; product rows follow it
+HEADER_ROW = 15
+FIRST_PRODUCT_ROW = HEADER_ROW + 1
+
+LAST_COLUMN = 9  # I
+
+# Product key shown in each A..I column of a product row, None for the cells covered by a merge
+PRODUCT_ROW_COLUMNS = ["Quantité", "Nom du produit", None, None, None, "Prix unitaire", None, "Prix total", None]
+
+# Merged (first, last) columns of a product row: product name B:E, unit price F:G, total price H:I
+PRODUCT_ROW_MERGES = ((2, 5), (6, 7), (8, 9))
+
+# Columns of the labels (F:G) and amounts (H:I) of the totals under the product rows
+LABEL_COLUMN = 6
+AMOUNT_COLUMN = 8
+
+# Palette styles of the A..I cells of a product row
+PRODUCT_ROW_STYLES = ["quantity", "product_name", "bottom", "bottom", "right_bottom",
+                      "price", "right_bottom", "price", "right_bottom"]
+
+
+def invoice_file_name(invoice_number):
+    return f"FACTURE {invoice_number}.xlsx"
+
+
+def format_client_address(client):
+    """Build the one-line address shown on the invoice from a saved client record."""
+    return f"{client.get('Adresse', '')}, {client.get('Adresse_cp', '')}, {client.get('Adresse_ville', '')}"
+
+
+def has_tva_number(client):
+    """Clients with a foreign TVA number are not charged the French TVA 20%."""
+    return bool(client.get("Num_TVA", ""))
+
+
+def render_invoice(client, products, payment_method, invoice_number, invoice_date=None, formulas=False):
+    """Build the invoice workbook.
+
+    client is a saved client record (same keys as clients.json), products a list of dicts with
+    "Nom du produit", "Quantité" and "Prix unitaire". The line totals are computed by invoice_money.
+    With formulas, the totals are written as SUM formulas over the line totals (see totals_lines).
+    """
+    current_date = format_invoice_date(invoice_date)
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Facture"
+    set_default_font(wb)
+    styles = StylePalette(ws)
+
+    # Add invoice number
+    ws.merge_cells('A1:I1')
+    for cell in ws[1]:
+        styles.apply(cell, "title")
+
+    # Add seller info
+    ws.merge_cells('A3:D3')
+    cell = ws['A3']
+    cell.value = "ELLIETECH PARIS 2014"
+    styles.apply(cell, "bold")
+    ws.merge_cells('A4:D4')
+    cell = ws['A4']
+    cell.value = "90 Rue de la Haie Coq Bâtiment 243,93300,Aubervilliers"
+    styles.apply(cell, "wrap")
+    ws.row_dimensions[4].height = 45
+    ws.merge_cells('A5:D5')
+    ws['A5'].value = "N° SIRET: 98741912400019"
+    ws.merge_cells('A6:D6')
+    ws['A6'].value = "N° TVA: FR 89 987419124"
+    ws.merge_cells('A7:D7')
+    ws['A7'].value = "Contact: 07 54 12 06 47"
+
+    # Add client info, framed by a thick border box
+    ws.merge_cells('F3:I3')
+    styles.apply(ws['F3'], "client_name")
+    styles.apply(ws['I3'], "box_top_right")
+    ws.merge_cells('F4:I4')
+    styles.apply(ws['F4'], "wrap")
+    write_client_contact(ws, client, None, styles.style_array("box_bottom_left"),
+                         styles.style_array("box_bottom_right"))
+
+    # Add time info
+    for row in (10, 11, 12):
+        ws.merge_cells(f'A{row}:F{row}')
+        styles.apply(ws[f'A{row}'], "band")
+
+    write_header_values(ws, client, payment_method, invoice_number, current_date)
+
+    # Add product info
+    ws['A15'] = "Quantité"
+    styles.apply(ws['A15'], "column_header")
+    ws.merge_cells('B15:E15')
+    ws['B15'] = "Nom du produit"
+    styles.apply(ws['B15'], "column_header")
+    ws.merge_cells('F15:G15')
+    ws['F15'] = "Prix unitaire HT"
+    styles.apply(ws['F15'], "column_header")
+    ws.merge_cells('H15:I15')
+    ws['H15'] = "Prix total HT"
+    styles.apply(ws['H15'], "column_header")
+
+    row_styles = [styles.style_array(name) for name in PRODUCT_ROW_STYLES]
+    totals = compute_totals(products, has_tva_number(client))
+    row = write_products(ws, products, totals.line_totals, row_styles)
+    write_totals(ws, row, totals, current_date, payment_method, styles.style_array("money"), formulas)
+
+    ws.page_setup.orientation = ws.ORIENTATION_PORTRAIT
+    ws.page_setup.paperSize = ws.PAPERSIZE_A4
+    ws.page_margins.left = 0.5
+    ws.page_margins.right = 0.5
+    ws.page_margins.top = 1
+    ws.page_margins.bottom = 1
+    ws.print_options.horizontalCentered = True
+
+    return wb
+
+
+#--------------------------------------------------sheet sections--------------------------------------------------
+# Shared by render_invoice, the template renderer (invoice_template.py) and the streaming renderer
+# (invoice_streaming.py)
+
+def format_invoice_date(invoice_date=None):
+    if invoice_date is None:
+        invoice_date = datetime.today()
+    return invoice_date.strftime('%d/%m/%Y')
+
+
+def header_values(client, payment_method, invoice_number, current_date):
+    """Return the variable cells above the product table (except the client contact rows) by coordinate."""
+    client_name = client["Nom de l'entreprise"]
+    return {
+        'A1': f"FACTURE N° FA{invoice_number}",
+        'F3': f"Client : {client_name.upper()}",
+        'F4': format_client_address(client),
+        'A10': f"Date de facturation: {current_date}",
+        'A11': f"Date de livraison: {current_date}",
+        'A12': f"Mode de paiement: {payment_method}",
+    }
+
+
+def write_header_values(ws, client, payment_method, invoice_number, current_date):
+    for coordinate, value in header_values(client, payment_method, invoice_number, current_date).items():
+        ws[coordinate].value = value
+
+
+def client_contact_lines(client):
+    """Return the lines closing the client info box from row 5: the TVA number (if any) then the phone."""
+    lines = []
+    if has_tva_number(client):
+        lines.append(f"N° TVA : {client['Num_TVA']}")
+    lines.append(f"Tel : {client.get('Contact', '')}")
+    return lines
+
+
+def write_client_contact(ws, client, tva_style, bottom_left_style, bottom_right_style):
+    """Write the TVA number (if any) and phone rows closing the client info box."""
+    lines = client_contact_lines(client)
+    for row, line in enumerate(lines, start=5):
+        ws.merge_cells(f'F{row}:I{row}')
+        ws[f'F{row}'].value = line
+    last_client_row = 4 + len(lines)
+    if len(lines) == 2 and tva_style is not None:
+        apply_style(ws['F5'], tva_style)
+    apply_style(ws[f'F{last_client_row}'], bottom_left_style)
+    apply_style(ws[f'I{last_client_row}'], bottom_right_style)
+
+
+def write_products(ws, products, line_totals, row_styles):
+    """Write one row per product from FIRST_PRODUCT_ROW, styling columns A..I with row_styles.
+
+    Return the row after the last product.
+    """
+    cells = ws._cells
+    layout = list(zip(range(1, len(PRODUCT_ROW_COLUMNS) + 1), PRODUCT_ROW_COLUMNS, row_styles))
+    merged_ranges = []
+    row = FIRST_PRODUCT_ROW
+    for product, total in zip(products, line_totals):
+        # Cells are created directly at their (row, column) key, without going through A1 addresses
+        for column, key, style in layout:
+            if key is None:
+                cell = MergedCell(ws, row, column)
+                cell._style = copy(style)
+            elif key == "Prix total":
+                cell = Cell(ws, row, column, total, style)
+            else:
+                cell = Cell(ws, row, column, product[key], style)
+            cells[row, column] = cell
+        for first_column, last_column in PRODUCT_ROW_MERGES:
+            merged_ranges.append(CellRange(min_col=first_column, min_row=row, max_col=last_column, max_row=row))
+        row += 1
+    # The product rows are new and never overlap: add their merges in one go rather than through
+    # ws.merge_cells, which parses an A1 range and compares it with every merge already on the sheet
+    # (as does MultiCellRange.add). The constructor takes any iterable of ranges, whether the openpyxl
+    # version keeps them in a list or a set.
+    ws.merged_cells = MultiCellRange([*ws.merged_cells.ranges, *merged_ranges])
+    return row
+
+
+def totals_lines(totals, current_date, payment_method, formulas=False):
+    """Return the lines under the product rows, as offsets from the row after the last product.
+
+    amounts are (offset, label, amount) lines written in F:G and H:I, phrases (offset, text) lines
+    written across A:I. The amounts are numbers (shown in euros by the money number format) or, with
+    formulas, Excel formulas over the line totals giving the same values.
+    """
+    if formulas and totals.line_totals:
+        ht, tva, ttc = total_formulas(len(totals.line_totals), totals.tva_exempt)
+    else:
+        ht, tva, ttc = totals.ht, totals.tva, totals.ttc
+    if totals.tva_exempt:
+        # Set TVA 20% to 0, add the phrase about TVA communo code and push the payment phrase to row + 6
+        amounts = [
+            (1, "Total HT", ht),
+            (2, "TVA 20%", tva),
+        ]
+        phrases = [
+            (5, "Exonération de TVA, article 262 ter 1 du CGI ». vente intracommunautaire"),
+            (6, f"Facture payée le {current_date} pour la somme de {totals.ttc:.2f} € par {payment_method}"),
+        ]
+    else:
+        amounts = [
+            (1, "Total HT", ht),
+            (2, "TVA 20%", tva),
+            (3, "Total TTC", ttc),
+        ]
+        phrases = [
+            (5, f"Facture payée le {current_date} pour la somme de {totals.ttc:.2f} € par {payment_method}"),
+        ]
+    return amounts, phrases
+
+
+def total_formulas(product_count, tva_exempt):
+    """Return the Total HT, TVA and Total TTC formulas of an invoice with product_count product rows.
+
+    The TVA is rounded to the cent on the total HT, as compute_totals does.
+    """
+    column = get_column_letter(AMOUNT_COLUMN)
+    row = FIRST_PRODUCT_ROW + product_count
+    ht = f"=SUM({column}{FIRST_PRODUCT_ROW}:{column}{row - 1})"
+    tva = 0 if tva_exempt else f"=ROUND({column}{row + 1}*{TVA_RATE},2)"
+    return ht, tva, f"={column}{row + 1}+{column}{row + 2}"
+
+
+def write_totals(ws, row, totals, current_date, payment_method, money_style, formulas=False):
+    """Write Total HT, TVA and Total TTC below the product rows, then the payment phrase."""
+    amounts, phrases = totals_lines(totals, current_date, payment_method, formulas)
+    for offset, label, amount in amounts:
+        ws.merge_cells(start_row=row + offset, start_column=LABEL_COLUMN, end_row=row + offset,
+                       end_column=LABEL_COLUMN + 1)
+        ws.cell(row + offset, LABEL_COLUMN, label)
+        ws.merge_cells(start_row=row + offset, start_column=AMOUNT_COLUMN, end_row=row + offset,
+                       end_column=AMOUNT_COLUMN + 1)
+        apply_style(ws.cell(row + offset, AMOUNT_COLUMN, amount), money_style)
+    for offset, text in phrases:
+        ws.merge_cells(start_row=row + offset, start_column=1, end_row=row + offset, end_column=LAST_COLUMN)
+        ws.cell(row + offset, 1, text)
+
+
+def render_invoice_bytes(client, products, payment_method, invoice_number, invoice_date=None, formulas=False):
+    """Render the invoice and return the xlsx file content."""
+    return workbook_bytes(render_invoice(client, products, payment_method, invoice_number, invoice_date,
+                                         formulas))
+
+
+def workbook_bytes(wb):
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
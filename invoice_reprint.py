@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime
+from invoice_archive import DEFAULT_ARCHIVE_DIR, find_archive
+from invoice_batch import make_product, render_job
+from invoice_ledger import DEFAULT_LEDGER, InvoiceLedger, file_sha256
+from invoice_renderer import invoice_file_name
+
+# Reprint of issued invoices from the ledger (invoice_ledger.py), without retyping them in the GUI:
+#   python invoice_reprint.py 430 431 [-o reprints] [--ledger factures.jsonl] [--template ...] [--formulas]
+#
+# An invoice is served, first that applies:
+#   1. from its original file, if it is still there with the SHA-256 recorded in the ledger
+#   2. extracted from the archive of its month (see invoice_archive.py) into the reprint directory
+#   3. from the reprint directory, if it was already rendered there from the same ledger data and options
+#   4. by rendering it again from the client, products, payment method and date of its ledger entry
+# The reprint directory keeps, for each invoice, the content hash of what it was rendered from and the
+# SHA-256 of the file (reprints.json), so a cached file that was since edited is rendered again too.
+
+DEFAULT_REPRINT_DIR = 'reprints'
+CACHE_FILE = 'reprints.json'
+
+
+def content_hash(entry, template=None, formulas=False):
+    """Hash of everything a reprint depends on: the ledger data and the rendering options."""
+    content = {key: entry[key] for key in ("number", "date", "client", "products", "payment_method")}
+    content["template"] = file_sha256(template) if template else None
+    content["formulas"] = formulas
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def entry_products(entry):
+    return [make_product(product["Nom du produit"], product["Quantité"], product["Prix unitaire"])
+            for product in entry["products"]]
+
+
+class InvoiceReprinter:
+    """Serve issued invoices from their file, the reprint cache or a new rendering."""
+
+    def __init__(self, ledger, output_dir=DEFAULT_REPRINT_DIR, template=None, formulas=False,
+                 archive_dir=DEFAULT_ARCHIVE_DIR):
+        self.ledger = ledger
+        self.output_dir = output_dir
+        self.archive_dir = archive_dir
+        self.template = template
+        self.formulas = formulas
+        self.cache_path = os.path.join(output_dir, CACHE_FILE)
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as file:
+                self.cache = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.cache = {}
+
+    def save_cache(self):
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.cache, file)
+        os.replace(temp_path, self.cache_path)
+
+    def reprint(self, number):
+        """Return the path of FACTURE number, rendering it only if no unchanged file is available."""
+        entry = self.ledger.get(number)
+        if entry is None:
+            raise ValueError(f"invoice {number} is not in the ledger")
+        if os.path.exists(entry["file"]) and file_sha256(entry["file"]) == entry["sha256"]:
+            return entry["file"]
+        archive = find_archive(number, self.archive_dir, entry["date"][:7])
+        if archive is not None:
+            excel_file = archive.extract(number, self.output_dir)
+            if file_sha256(excel_file) == entry["sha256"]:
+                return excel_file
+
+        key = content_hash(entry, self.template, self.formulas)
+        excel_file = os.path.join(self.output_dir, invoice_file_name(number))
+        cached = self.cache.get(str(number))
+        if (cached is not None and cached["content"] == key and os.path.exists(excel_file)
+                and file_sha256(excel_file) == cached["sha256"]):
+            return excel_file
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        render_job((entry["client"], entry_products(entry), entry["payment_method"], number,
+                    datetime.strptime(entry["date"], '%Y-%m-%d'), excel_file, self.template, self.formulas))
+        self.cache[str(number)] = {"content": key, "sha256": file_sha256(excel_file)}
+        self.save_cache()
+        return excel_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprint issued invoices from the invoice ledger.")
+    parser.add_argument("numbers", nargs="+", type=int, help="invoice numbers")
+    parser.add_argument("-o", "--output-dir", default=DEFAULT_REPRINT_DIR, help="directory for the reprinted files")
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER, help="invoice ledger")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="directory of the monthly invoice archives")
+    parser.add_argument("--template", help="FACTURE workbook to stamp invoices from (e.g. \"FACTURE 25.xlsx\")")
+    parser.add_argument("--formulas", action="store_true",
+                        help="write the totals as formulas over the line totals instead of numbers")
+    args = parser.parse_args(argv)
+
+    reprinter = InvoiceReprinter(InvoiceLedger(args.ledger), args.output_dir, args.template, args.formulas,
+                                 args.archive_dir)
+    try:
+        for number in args.numbers:
+            print(reprinter.reprint(number))
+    except (ValueError, KeyError, OSError, zipfile.BadZipFile) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
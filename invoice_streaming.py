@@ -0,0 +1,149 @@
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.worksheet.worksheet import Worksheet
+from invoice_renderer import HEADER_ROW, PRODUCT_ROW_MERGES, PRODUCT_ROW_STYLES, format_invoice_date, has_tva_number, header_values, \
+    client_contact_lines, totals_lines
+from invoice_money import compute_totals
+from invoice_styles import StylePalette, apply_style, set_default_font
+
+# Streaming renderer for invoices with thousands of product lines. It produces the same sheet as
+# render_invoice but with a write-only workbook: each row is written to disk as soon as it is built,
+# so memory does not grow with the number of products (only the merged ranges are kept until the end).
+
+# Invoices with at least this many products are rendered by write_invoice_streaming in batch mode
+STREAMING_THRESHOLD = 500
+
+
+class _RowWriter:
+    """Append rows of A..I cells to a write-only sheet, collecting the merged ranges."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.styles = StylePalette(ws)
+        self.merged_ranges = []
+        self.row = 0
+
+    def cell(self, value=None, style=None):
+        cell = WriteOnlyCell(self.ws, value)
+        if style is not None:
+            apply_style(cell, self.styles.style_array(style))
+        return cell
+
+    def merge(self, first_column, last_column):
+        """Merge columns first_column..last_column of the last appended row."""
+        self.merged_ranges.append(CellRange(min_col=first_column, min_row=self.row, max_col=last_column,
+                                            max_row=self.row))
+
+    def append(self, cells=()):
+        self.row += 1
+        self.ws.append(list(cells))
+
+    def close(self):
+        # Built in one go: adding ranges one by one checks each against all the previous ones
+        self.ws.merged_cells = MultiCellRange(self.merged_ranges)
+
+
+def write_invoice_streaming(client, products, payment_method, invoice_number, output, invoice_date=None,
+                            formulas=False):
+    """Render the invoice to output (path or binary file object) with a write-only workbook.
+
+    Return the InvoiceTotals of the invoice.
+    """
+    current_date = format_invoice_date(invoice_date)
+    values = header_values(client, payment_method, invoice_number, current_date)
+    contact_lines = client_contact_lines(client)
+
+    wb = Workbook(write_only=True)
+    set_default_font(wb)
+    ws = wb.create_sheet("Facture")
+    ws.row_dimensions[4].height = 45
+    rows = _RowWriter(ws)
+    cell = rows.cell
+
+    # Title
+    rows.append([cell(values['A1'], "title")] + [cell(style="title") for _ in range(8)])
+    rows.merge(1, 9)
+    rows.append()
+
+    # Seller info (A:D) next to the client info box (F:I)
+    seller_lines = [
+        cell("ELLIETECH PARIS 2014", "bold"),
+        cell("90 Rue de la Haie Coq Bâtiment 243,93300,Aubervilliers", "wrap"),
+        cell("N° SIRET: 98741912400019"),
+        cell("N° TVA: FR 89 987419124"),
+        cell("Contact: 07 54 12 06 47"),
+    ]
+    box_lines = [
+        (cell(values['F3'], "client_name"), cell(style="box_top_right")),
+        (cell(values['F4'], "wrap"), None),
+    ]
+    for line in contact_lines[:-1]:
+        box_lines.append((cell(line), None))
+    box_lines.append((cell(contact_lines[-1], "box_bottom_left"), cell(style="box_bottom_right")))
+    for index, seller_cell in enumerate(seller_lines):
+        if index < len(box_lines):
+            box_cell, right_cell = box_lines[index]
+            rows.append([seller_cell, None, None, None, None, box_cell, None, None, right_cell])
+            rows.merge(6, 9)
+        else:
+            rows.append([seller_cell])
+        rows.merge(1, 4)
+    rows.append()
+    rows.append()
+
+    # Dates and payment method
+    for coordinate in ('A10', 'A11', 'A12'):
+        rows.append([cell(values[coordinate], "band")])
+        rows.merge(1, 6)
+    while rows.row < HEADER_ROW - 1:
+        rows.append()
+
+    # Product table
+    rows.append([cell("Quantité", "column_header"), cell("Nom du produit", "column_header"), None, None, None,
+                 cell("Prix unitaire HT", "column_header"), None, cell("Prix total HT", "column_header")])
+    for first_column, last_column in PRODUCT_ROW_MERGES:
+        rows.merge(first_column, last_column)
+
+    # One set of cells is reused for every product row: each row is serialised when it is appended
+    product_cells = [cell(style=name) for name in PRODUCT_ROW_STYLES]
+    quantity_cell, name_cell, unit_price_cell, total_cell = (product_cells[0], product_cells[1],
+                                                             product_cells[5], product_cells[7])
+    totals = compute_totals(products, has_tva_number(client))
+    for product, total in zip(products, totals.line_totals):
+        quantity_cell.value = product["Quantité"]
+        name_cell.value = product["Nom du produit"]
+        unit_price_cell.value = product["Prix unitaire"]
+        total_cell.value = total
+        rows.append(product_cells)
+        for first_column, last_column in PRODUCT_ROW_MERGES:
+            rows.merge(first_column, last_column)
+
+    # Totals and payment phrase, offsets count from the row after the last product as in write_totals
+    amounts, phrases = totals_lines(totals, current_date, payment_method, formulas)
+    lines = {offset: (label, amount) for offset, label, amount in amounts}
+    lines.update(phrases)
+    for offset in range(max(lines) + 1):
+        line = lines.get(offset)
+        if line is None:
+            rows.append()
+        elif isinstance(line, tuple):
+            label, amount = line
+            rows.append([None, None, None, None, None, cell(label), None, cell(amount, "money")])
+            rows.merge(6, 7)
+            rows.merge(8, 9)
+        else:
+            rows.append([cell(line)])
+            rows.merge(1, 9)
+
+    ws.page_setup.orientation = Worksheet.ORIENTATION_PORTRAIT
+    ws.page_setup.paperSize = Worksheet.PAPERSIZE_A4
+    ws.page_margins.left = 0.5
+    ws.page_margins.right = 0.5
+    ws.page_margins.top = 1
+    ws.page_margins.bottom = 1
+    ws.print_options.horizontalCentered = True
+
+    rows.close()
+    wb.save(output)
+    return totals
@@ -0,0 +1,78 @@
+from copy import copy
+from openpyxl.cell import Cell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.utils.indexed_list import IndexedList
+
+# Style palette of the invoice sheet.
+#
+# The Font/Alignment/PatternFill/Border objects are built once per process and shared by every
+# invoice. StylePalette registers each style once in a workbook's stylesheet and keeps the resulting
+# style ids, so styling a cell is a copy of a small array instead of hashing four style objects into
+# the stylesheet for every cell.
+
+MONEY_FORMAT = '#,##0.00 €'
+
+# Font 0 of the stylesheet, used by every cell that has no font of its own
+DEFAULT_FONT = Font(name='Calibri', size=11, family=2, scheme='minor')
+
+GRAY_FILL = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
+TITLE_FONT = Font(name='Calibri', size=26, bold=True)
+BOLD_FONT = Font(name='Calibri', bold=True)
+CENTER = Alignment(horizontal="center")
+WRAP = Alignment(horizontal="left", vertical="center", wrap_text=True)
+
+THIN = Side(style='thin')
+THICK = Side(style='thick')
+
+STYLES = {
+    "title": dict(font=TITLE_FONT, alignment=CENTER, fill=GRAY_FILL),
+    "bold": dict(font=BOLD_FONT),
+    "wrap": dict(alignment=WRAP),
+    "band": dict(font=BOLD_FONT, fill=GRAY_FILL),
+    "column_header": dict(alignment=CENTER, fill=GRAY_FILL),
+    "money": dict(number_format=MONEY_FORMAT),
+
+    # Client info box
+    "client_name": dict(font=BOLD_FONT, border=Border(top=THICK, left=THICK)),
+    "box_top_right": dict(border=Border(top=THICK, right=THICK)),
+    "box_bottom_left": dict(border=Border(bottom=THICK, left=THICK)),
+    "box_bottom_right": dict(border=Border(bottom=THICK, right=THICK)),
+
+    # Product rows
+    "quantity": dict(alignment=CENTER, border=Border(left=THIN, right=THIN, bottom=THIN)),
+    "product_name": dict(alignment=CENTER, border=Border(left=THIN, bottom=THIN)),
+    "price": dict(alignment=CENTER, number_format=MONEY_FORMAT, border=Border(left=THIN, bottom=THIN)),
+    "bottom": dict(border=Border(bottom=THIN)),
+    "right_bottom": dict(border=Border(right=THIN, bottom=THIN)),
+}
+
+
+def set_default_font(wb, font=DEFAULT_FONT):
+    """Make font the workbook default font. Must be called before any cell gets a font."""
+    wb._fonts = IndexedList([font])
+
+
+def apply_style(cell, style_array):
+    # Copy so that a later cell.font = ... on one cell does not restyle the others
+    cell._style = copy(style_array)
+
+
+class StylePalette:
+    """Style ids of STYLES in the workbook of ws, registered the first time each style is used."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.style_arrays = {}
+
+    def style_array(self, name):
+        style = self.style_arrays.get(name)
+        if style is None:
+            # Let openpyxl register the style objects through a detached cell
+            cell = Cell(self.ws)
+            for attribute, value in STYLES[name].items():
+                setattr(cell, attribute, value)
+            style = self.style_arrays[name] = cell._style
+        return style
+
+    def apply(self, cell, name):
+        apply_style(cell, self.style_array(name))
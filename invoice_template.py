@@ -0,0 +1,125 @@
+import os
+from copy import copy
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import Cell, MergedCell
+from openpyxl.utils.indexed_list import IndexedList
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.merge import MergedCellRange
+from invoice_renderer import HEADER_ROW, FIRST_PRODUCT_ROW, format_invoice_date, has_tva_number, \
+    write_header_values, write_client_contact, write_products, write_totals, workbook_bytes
+from invoice_money import compute_totals
+from invoice_styles import StylePalette
+
+# Template mode: the layout above the product table (title, seller block, client box, dates, column
+# headers), the page setup and the product row styles come from a finished FACTURE workbook, e.g.
+# "FACTURE 25.xlsx". The template is parsed once per process; each invoice only copies the cached
+# header cells and fills the variable cells and the product rows.
+
+DEFAULT_TEMPLATE = "FACTURE 25.xlsx"
+
+# Stylesheet tables the style ids of the template cells refer to
+STYLESHEET_TABLES = ["_fonts", "_fills", "_borders", "_alignments", "_number_formats", "_protections"]
+
+# Client contact rows (N° TVA / Tel) of the client box, written for each client
+CLIENT_CONTACT_CELLS = CellRange("F5:I6")
+
+_templates = {}
+
+
+def load_template(path=DEFAULT_TEMPLATE):
+    """Return the parsed template, reading the file again only when it has changed."""
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    template = _templates.get(path)
+    if template is None or template.mtime != mtime:
+        template = _templates[path] = InvoiceTemplate(path, mtime)
+    return template
+
+
+class InvoiceTemplate:
+    """Static part of a FACTURE template workbook, stamped with the data of each invoice."""
+
+    def __init__(self, path, mtime=None):
+        self.mtime = mtime
+        wb = load_workbook(path)
+        ws = wb.active
+        self.title = ws.title
+        self.stylesheet = {table: list(getattr(wb, table)) for table in STYLESHEET_TABLES}
+
+        self.cells = []
+        for row in ws.iter_rows(max_row=HEADER_ROW):
+            for cell in row:
+                if cell.coordinate in CLIENT_CONTACT_CELLS:
+                    continue
+                if cell.value is None and not cell.has_style:
+                    continue
+                self.cells.append((cell.row, cell.column, cell.value, copy(cell._style),
+                                   isinstance(cell, MergedCell)))
+        self.merged_ranges = [
+            cell_range.coord for cell_range in ws.merged_cells.ranges
+            if cell_range.max_row <= HEADER_ROW and not cell_range.issubset(CLIENT_CONTACT_CELLS)
+        ]
+
+        # The last row of the client box carries its bottom border, the row above it (if any) the TVA number
+        box_bottom_row = 6 if ws['F6'].value else 5
+        self.tva_style = copy(ws['F5']._style) if box_bottom_row == 6 else None
+        self.box_bottom_styles = (copy(ws.cell(box_bottom_row, 6)._style), copy(ws.cell(box_bottom_row, 9)._style))
+        self.product_row_styles = [copy(ws.cell(FIRST_PRODUCT_ROW, column)._style) for column in range(1, 10)]
+
+        self.row_heights = {row: dimension.height for row, dimension in ws.row_dimensions.items()
+                            if dimension.height and row <= HEADER_ROW}
+        self.column_widths = {column: dimension.width for column, dimension in ws.column_dimensions.items()
+                              if dimension.width}
+        self.orientation = ws.page_setup.orientation
+        self.paper_size = ws.page_setup.paperSize
+        self.page_margins = copy(ws.page_margins)
+        self.print_options = copy(ws.print_options)
+
+    def stamp(self, client, products, payment_method, invoice_number, invoice_date=None, formulas=False):
+        """Build the invoice workbook from the template."""
+        current_date = format_invoice_date(invoice_date)
+
+        wb = Workbook()
+        for table, items in self.stylesheet.items():
+            setattr(wb, table, IndexedList(items))
+        ws = wb.active
+        ws.title = self.title
+
+        for row, column, value, style, merged in self.cells:
+            if merged:
+                cell = MergedCell(ws, row, column)
+            else:
+                cell = Cell(ws, row, column, value)
+            cell._style = copy(style)
+            ws._cells[row, column] = cell
+        for coord in self.merged_ranges:
+            ws.merged_cells.add(MergedCellRange(ws, coord))
+
+        write_header_values(ws, client, payment_method, invoice_number, current_date)
+        write_client_contact(ws, client, self.tva_style, *self.box_bottom_styles)
+        totals = compute_totals(products, has_tva_number(client))
+        row = write_products(ws, products, totals.line_totals, self.product_row_styles)
+        write_totals(ws, row, totals, current_date, payment_method, StylePalette(ws).style_array("money"),
+                     formulas)
+
+        for row, height in self.row_heights.items():
+            ws.row_dimensions[row].height = height
+        for column, width in self.column_widths.items():
+            ws.column_dimensions[column].width = width
+        ws.page_setup.orientation = self.orientation
+        ws.page_setup.paperSize = self.paper_size
+        ws.page_margins = copy(self.page_margins)
+        ws.print_options = copy(self.print_options)
+        return wb
+
+
+def render_invoice_from_template(template_path, client, products, payment_method, invoice_number,
+                                 invoice_date=None, formulas=False):
+    return load_template(template_path).stamp(client, products, payment_method, invoice_number, invoice_date,
+                                              formulas)
+
+
+def render_invoice_from_template_bytes(template_path, client, products, payment_method, invoice_number,
+                                       invoice_date=None, formulas=False):
+    return workbook_bytes(render_invoice_from_template(template_path, client, products, payment_method,
+                                                       invoice_number, invoice_date, formulas))